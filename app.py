@@ -1,7 +1,21 @@
-from datetime import datetime, timedelta
+from bisect import bisect_right
+from collections import OrderedDict, deque
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timedelta
 from functools import wraps
+import csv
+import hashlib
+import io
+import json
 import os
-
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from xml.sax.saxutils import escape
+
+import click
 from flask import (
     Flask,
     render_template,
@@ -11,12 +25,24 @@ from flask import (
     flash,
     session,
     g,
-    send_file
+    send_file,
+    stream_template,
+    stream_with_context,
+    has_request_context,
 )
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import text
+from sqlalchemy import event, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.dialects import postgresql, sqlite
 from dotenv import load_dotenv
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
 
 # Load environment variables from .env file
 load_dotenv()
@@ -125,6 +151,11 @@ class Expense(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_expenses_date_id", "date", "id"),
+        db.Index("ix_expenses_category_date", "category", "date"),
+    )
+
 
 class DoctorBill(db.Model):
     """Doctor payment for TVS / ULTRA / LAB etc. (kept for compatibility)."""
@@ -141,6 +172,10 @@ class DoctorBill(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_doctor_bills_date_id", "date", "id"),
+    )
+
 
 class BalanceEntry(db.Model):
     """Bank ledger: deposits, withdrawals and running balance."""
@@ -157,6 +192,10 @@ class BalanceEntry(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_balance_entries_date_id", "date", "id"),
+    )
+
 
 class Staff(db.Model):
     """Staff list with base monthly salary."""
@@ -191,6 +230,13 @@ class StaffPayment(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_staff_payments_staff_date", "staff_id", "date"),
+        db.Index("ix_staff_payments_date", "date"),
+        db.Index("ix_staff_payments_expense_id", "expense_id"),
+        db.Index("ix_staff_payments_bank_entry_id", "bank_entry_id"),
+    )
+
 
 class ExpenseTemplate(db.Model):
     """Reusable expense types (for dropdown in Add Expense)."""
@@ -216,6 +262,10 @@ class DeleteLog(db.Model):
     entity_id = db.Column(db.Integer)
     description = db.Column(db.String(255))
 
+    __table_args__ = (
+        db.Index("ix_delete_logs_timestamp", "timestamp"),
+    )
+
 
 class Supplier(db.Model):
     """Suppliers that we pay part by part."""
@@ -224,14 +274,16 @@ class Supplier(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False)
     details = db.Column(db.String(255))
-    total_due = db.Column(db.Float, default=0)  # calculated from bills
+    total_due = db.Column(db.Float, default=0)   # sum of bills, kept by track_supplier_totals
+    total_paid = db.Column(db.Float, default=0)  # sum of payments, same
 
     payments = db.relationship("SupplierPayment", backref="supplier", lazy="dynamic")
     bills = db.relationship("SupplierBill", backref="supplier", lazy="dynamic")
 
-    def recalc_total_due(self):
-        """Recalculate total_due from all bills."""
-        self.total_due = self.bills.with_entities(db.func.sum(SupplierBill.amount)).scalar() or 0
+    @property
+    def balance(self) -> float:
+        """Still payable: bills minus payments."""
+        return (self.total_due or 0) - (self.total_paid or 0)
 
 
 class SupplierBill(db.Model):
@@ -249,6 +301,10 @@ class SupplierBill(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_supplier_bills_supplier_date", "supplier_id", "date"),
+    )
+
 
 class SupplierPayment(db.Model):
     """Individual payments to suppliers."""
@@ -269,6 +325,12 @@ class SupplierPayment(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_supplier_payments_supplier_date", "supplier_id", "date"),
+        db.Index("ix_supplier_payments_expense_id", "expense_id"),
+        db.Index("ix_supplier_payments_bank_entry_id", "bank_entry_id"),
+    )
+
 
 class LabCollection(db.Model):
     """Daily collection amount coming from Lab (one per day)."""
@@ -284,6 +346,10 @@ class LabCollection(db.Model):
     created_by_id = db.Column(db.Integer, db.ForeignKey("users.id"), nullable=True)
     created_by = db.relationship("User", foreign_keys=[created_by_id])
 
+    __table_args__ = (
+        db.Index("ix_lab_collections_date", "date"),
+    )
+
 
 class StaffMonthlySalary(db.Model):
     """
@@ -308,6 +374,651 @@ class StaffMonthlySalary(db.Model):
     staff = db.relationship("Staff", backref=db.backref("monthly_salaries", lazy="dynamic"))
 
 
+class LedgerTotals(db.Model):
+    """
+    All-time running totals behind the cash-in-hand and bank-balance cards.
+    Single row (id=1), kept in step with the ledger tables by the flush hook.
+    """
+    __tablename__ = "ledger_totals"
+
+    id = db.Column(db.Integer, primary_key=True)
+    total_collection = db.Column(db.Float, nullable=False, default=0)    # DaySummary.total_collection
+    total_lab = db.Column(db.Float, nullable=False, default=0)           # LabCollection.amount
+    total_expenses = db.Column(db.Float, nullable=False, default=0)      # Expense.amount
+    total_doctor_bills = db.Column(db.Float, nullable=False, default=0)  # DoctorBill.amount
+    bank_credits = db.Column(db.Float, nullable=False, default=0)        # BalanceEntry.credit
+    bank_debits = db.Column(db.Float, nullable=False, default=0)         # BalanceEntry.debit
+    updated_at = db.Column(db.DateTime, default=datetime.now)
+
+    @property
+    def bank_balance(self) -> float:
+        return (self.bank_credits or 0) - (self.bank_debits or 0)
+
+    @property
+    def total_wealth(self) -> float:
+        return (
+            (self.total_collection or 0)
+            + (self.total_lab or 0)
+            - (self.total_expenses or 0)
+            - (self.total_doctor_bills or 0)
+        )
+
+    @property
+    def cash_in_hand(self) -> float:
+        return self.total_wealth - self.bank_balance
+
+
+class DailyRollup(db.Model):
+    """
+    Per-date totals of the ledger tables (same columns as LedgerTotals),
+    kept up to date by the flush hook so range reports read one row per day.
+    """
+    __tablename__ = "daily_rollups"
+
+    date = db.Column(db.Date, primary_key=True)
+    total_collection = db.Column(db.Float, nullable=False, default=0)
+    total_lab = db.Column(db.Float, nullable=False, default=0)
+    total_expenses = db.Column(db.Float, nullable=False, default=0)
+    total_doctor_bills = db.Column(db.Float, nullable=False, default=0)
+    bank_credits = db.Column(db.Float, nullable=False, default=0)
+    bank_debits = db.Column(db.Float, nullable=False, default=0)
+
+
+class DailyExpenseRollup(db.Model):
+    """Per-date, per-category expense totals (companion of DailyRollup)."""
+    __tablename__ = "daily_expense_rollups"
+
+    date = db.Column(db.Date, primary_key=True)
+    category = db.Column(db.String(100), primary_key=True)
+    amount = db.Column(db.Float, nullable=False, default=0)
+
+
+class TableVersion(db.Model):
+    """
+    Write counter per table and month ("YYYY-MM" of the row's date, ""
+    for undated rows and bulk statements). Bumped in the writing
+    transaction; cached reports are keyed on the counters they read.
+    """
+    __tablename__ = "table_versions"
+
+    table_name = db.Column(db.String(50), primary_key=True)
+    period = db.Column(db.String(7), primary_key=True, default="")
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class SchemaVersion(db.Model):
+    """One row per applied migration (see MIGRATIONS)."""
+    __tablename__ = "schema_version"
+
+    version = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.now)
+
+
+# ============================================================
+#  Ledger Totals & Daily Rollups (maintained on every flush)
+# ============================================================
+
+# model -> {tracked attribute: LedgerTotals / DailyRollup column}
+LEDGER_FIELDS = {
+    DaySummary: {"total_collection": "total_collection"},
+    LabCollection: {"amount": "total_lab"},
+    Expense: {"amount": "total_expenses"},
+    DoctorBill: {"amount": "total_doctor_bills"},
+    BalanceEntry: {"credit": "bank_credits", "debit": "bank_debits"},
+}
+
+# attributes that place a ledger row in the daily rollups
+LEDGER_KEYS = {
+    Expense: ("date", "category"),
+}
+
+ROLLUP_COLUMNS = (
+    "total_collection",
+    "total_lab",
+    "total_expenses",
+    "total_doctor_bills",
+    "bank_credits",
+    "bank_debits",
+)
+
+
+def _tracked_attrs(model) -> tuple:
+    return tuple(LEDGER_FIELDS[model]) + LEDGER_KEYS.get(model, ("date",))
+
+
+def _load_old_value(target, value, oldvalue, initiator):
+    """No-op 'set' listener; registering it with active_history keeps the old value."""
+
+
+for _model in LEDGER_FIELDS:
+    for _attr in _tracked_attrs(_model):
+        event.listen(getattr(_model, _attr), "set", _load_old_value, active_history=True)
+
+
+def _old_value(obj, attr):
+    """Value of `attr` as currently stored in the database row."""
+    history = inspect(obj).attrs[attr].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(obj, attr)
+
+
+def row_changes(session, tracked: dict):
+    """
+    Yield (model, before, after) for every row of a model in `tracked`
+    ({model: attribute names}) in this flush. before/after map each
+    attribute to its value; before is None for inserts and after is None
+    for deletes.
+    """
+    for obj in session.new:
+        if type(obj) in tracked:
+            attrs = tracked[type(obj)]
+            yield type(obj), None, {a: getattr(obj, a) for a in attrs}
+
+    for obj in session.deleted:
+        if type(obj) in tracked:
+            attrs = tracked[type(obj)]
+            yield type(obj), {a: _old_value(obj, a) for a in attrs}, None
+
+    for obj in session.dirty:
+        if type(obj) in tracked and session.is_modified(obj):
+            attrs = tracked[type(obj)]
+            before = {a: _old_value(obj, a) for a in attrs}
+            after = {a: getattr(obj, a) for a in attrs}
+            if before != after:
+                yield type(obj), before, after
+
+
+def ledger_changes(session):
+    """row_changes() for the ledger rows and their tracked attributes."""
+    return row_changes(session, {model: _tracked_attrs(model) for model in LEDGER_FIELDS})
+
+
+def apply_ledger_totals(deltas: dict) -> None:
+    """Add {LedgerTotals column: delta} to the totals row (no commit)."""
+    values = {col: getattr(LedgerTotals, col) + delta for col, delta in deltas.items() if delta}
+    if not values:
+        return
+    values["updated_at"] = datetime.now()
+    db.session.execute(
+        db.update(LedgerTotals).where(LedgerTotals.id == 1).values(values)
+    )
+
+
+def _upsert_insert(table):
+    """INSERT construct with on_conflict_do_update for the bound database."""
+    if db.engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def _add_to_rollup(model, key_cols: tuple, rows: list) -> None:
+    """Upsert rows into a rollup table, adding to the stored values on conflict."""
+    if not rows:
+        return
+    table = model.__table__
+    stmt = _upsert_insert(table).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(key_cols),
+        set_={
+            col: table.c[col] + stmt.excluded[col]
+            for col in rows[0] if col not in key_cols
+        },
+    )
+    db.session.execute(stmt)
+
+
+def apply_daily_rollups(daily: dict, by_category: dict) -> None:
+    """
+    Add {date: {column: delta}} to DailyRollup and {(date, category): delta}
+    to DailyExpenseRollup (no commit).
+    """
+    _add_to_rollup(DailyRollup, ("date",), [
+        {"date": day, **{col: cols.get(col, 0) for col in ROLLUP_COLUMNS}}
+        for day, cols in daily.items() if any(cols.values())
+    ])
+    _add_to_rollup(DailyExpenseRollup, ("date", "category"), [
+        {"date": day, "category": category, "amount": delta}
+        for (day, category), delta in by_category.items() if delta
+    ])
+
+
+def fold_ledger_row(model, snapshot: dict, sign: int, totals: dict, daily: dict,
+                    by_category: dict) -> None:
+    """
+    Add sign * one ledger row (a dict of its tracked attributes) to the
+    pending deltas for apply_ledger_totals() / apply_daily_rollups().
+    """
+    day = daily.setdefault(snapshot["date"], {})
+    for attr, col in LEDGER_FIELDS[model].items():
+        delta = sign * (snapshot[attr] or 0)
+        totals[col] = totals.get(col, 0) + delta
+        day[col] = day.get(col, 0) + delta
+    if model is Expense:
+        key = (snapshot["date"], snapshot["category"])
+        by_category[key] = by_category.get(key, 0) + sign * (snapshot["amount"] or 0)
+
+
+@event.listens_for(db.session, "before_flush")
+def track_ledger_changes(session, flush_context, instances):
+    """
+    Fold inserts/updates/deletes of ledger rows into LedgerTotals and the
+    daily rollups, in the same transaction as the change itself.
+    """
+    totals = {}
+    daily = {}
+    by_category = {}
+    for model, before, after in ledger_changes(session):
+        for snapshot, sign in ((before, -1), (after, 1)):
+            if snapshot is not None:
+                fold_ledger_row(model, snapshot, sign, totals, daily, by_category)
+
+    apply_ledger_totals(totals)
+    apply_daily_rollups(daily, by_category)
+
+
+def live_ledger_totals() -> dict:
+    """All-time totals computed from the ledger tables themselves."""
+    return {
+        "total_collection": db.session.query(db.func.sum(DaySummary.total_collection)).scalar() or 0,
+        "total_lab": db.session.query(db.func.sum(LabCollection.amount)).scalar() or 0,
+        "total_expenses": db.session.query(db.func.sum(Expense.amount)).scalar() or 0,
+        "total_doctor_bills": db.session.query(db.func.sum(DoctorBill.amount)).scalar() or 0,
+        "bank_credits": db.session.query(db.func.sum(BalanceEntry.credit)).scalar() or 0,
+        "bank_debits": db.session.query(db.func.sum(BalanceEntry.debit)).scalar() or 0,
+    }
+
+
+def rebuild_ledger_totals() -> LedgerTotals:
+    """Overwrite the totals row from live aggregates (no commit)."""
+    totals = db.session.get(LedgerTotals, 1)
+    if totals is None:
+        totals = LedgerTotals(id=1)
+        db.session.add(totals)
+    for col, value in live_ledger_totals().items():
+        setattr(totals, col, value)
+    totals.updated_at = datetime.now()
+    return totals
+
+
+def get_ledger_totals() -> LedgerTotals:
+    """The running totals row, rebuilt from live data if it does not exist yet."""
+    totals = db.session.get(LedgerTotals, 1)
+    if totals is None:
+        totals = rebuild_ledger_totals()
+        db.session.commit()
+    return totals
+
+
+def lock_bank_balance() -> float:
+    """
+    Current bank balance from the LedgerTotals row, locked until the
+    transaction ends so a concurrent debit waits for this one and then
+    sees its effect. Check a debit against this value, then add the
+    BalanceEntry in the same transaction.
+
+    PostgreSQL locks the row with SELECT ... FOR UPDATE. SQLite has no
+    row locks: touching the row first takes the database write lock,
+    which serialises writers the same way.
+    """
+    get_ledger_totals()
+    if db.engine.dialect.name == "sqlite":
+        db.session.execute(
+            db.update(LedgerTotals).where(LedgerTotals.id == 1).values(updated_at=datetime.now())
+        )
+    credits, debits = db.session.query(
+        LedgerTotals.bank_credits, LedgerTotals.bank_debits
+    ).filter(LedgerTotals.id == 1).with_for_update().one()
+    return (credits or 0) - (debits or 0)
+
+
+def verify_ledger_totals(repair: bool = False) -> list:
+    """
+    Compare the stored totals with live aggregates.
+    Returns [(column, stored, live)] for every mismatch; rebuilds the row
+    and commits when repair=True and something was off.
+    """
+    totals = db.session.get(LedgerTotals, 1, populate_existing=True)
+    mismatches = []
+    for col, live in live_ledger_totals().items():
+        stored = getattr(totals, col) if totals else None
+        if stored is None or abs(stored - live) > 0.005:
+            mismatches.append((col, stored, live))
+
+    if repair and mismatches:
+        rebuild_ledger_totals()
+        db.session.commit()
+    return mismatches
+
+
+def live_daily_rollups() -> tuple:
+    """
+    Per-date totals computed from the ledger tables themselves:
+    ({date: {column: total}}, {(date, category): expense total}).
+    """
+    daily = {}
+    for model, fields in LEDGER_FIELDS.items():
+        rows = db.session.query(
+            model.date, *[db.func.sum(getattr(model, attr)) for attr in fields]
+        ).group_by(model.date)
+        for day, *sums in rows:
+            cols = daily.setdefault(day, dict.fromkeys(ROLLUP_COLUMNS, 0))
+            for col, value in zip(fields.values(), sums):
+                cols[col] += value or 0
+
+    by_category = {
+        (day, category): total or 0
+        for day, category, total in db.session.query(
+            Expense.date, Expense.category, db.func.sum(Expense.amount)
+        ).group_by(Expense.date, Expense.category)
+    }
+    return daily, by_category
+
+
+def rebuild_daily_rollups() -> None:
+    """Recreate both rollup tables from the ledger tables (no commit)."""
+    daily, by_category = live_daily_rollups()
+    DailyRollup.query.delete()
+    DailyExpenseRollup.query.delete()
+    if daily:
+        db.session.execute(db.insert(DailyRollup), [
+            {"date": day, **cols} for day, cols in daily.items()
+        ])
+    if by_category:
+        db.session.execute(db.insert(DailyExpenseRollup), [
+            {"date": day, "category": category, "amount": amount}
+            for (day, category), amount in by_category.items()
+        ])
+    # Reports cached from the old rollups are stale now
+    bump_table_versions(db.session.connection(), {(DailyRollup.__tablename__, "")})
+
+
+def verify_daily_rollups(repair: bool = False) -> list:
+    """
+    Compare the rollup tables with live per-date aggregates.
+    Returns the sorted dates that disagree; rebuilds both tables and commits
+    when repair=True and something was off.
+    """
+    live_daily, live_categories = live_daily_rollups()
+    stored_daily = {
+        r.date: {col: getattr(r, col) for col in ROLLUP_COLUMNS}
+        for r in DailyRollup.query.all()
+    }
+    stored_categories = {
+        (r.date, r.category): r.amount for r in DailyExpenseRollup.query.all()
+    }
+
+    bad_dates = set()
+    zeros = dict.fromkeys(ROLLUP_COLUMNS, 0)
+    for day in set(live_daily) | set(stored_daily):
+        live = live_daily.get(day, zeros)
+        stored = stored_daily.get(day, zeros)
+        if any(abs((stored[col] or 0) - live[col]) > 0.005 for col in ROLLUP_COLUMNS):
+            bad_dates.add(day)
+    for key in set(live_categories) | set(stored_categories):
+        if abs((stored_categories.get(key) or 0) - live_categories.get(key, 0)) > 0.005:
+            bad_dates.add(key[0])
+
+    if repair and bad_dates:
+        rebuild_daily_rollups()
+        db.session.commit()
+    return sorted(bad_dates)
+
+
+# ============================================================
+#  Supplier Totals (maintained on every flush)
+# ============================================================
+# Supplier.total_due (sum of bills) and Supplier.total_paid (sum of
+# payments) move by the amount of each bill/payment written, in the same
+# transaction. Bulk statements fold their own deltas (cascade_delete);
+# `flask verify-totals` finds and repairs any drift.
+
+# model -> Supplier column its amounts add up into
+SUPPLIER_FIELDS = {
+    SupplierBill: "total_due",
+    SupplierPayment: "total_paid",
+}
+
+for _model in SUPPLIER_FIELDS:
+    for _attr in ("supplier_id", "amount"):
+        event.listen(getattr(_model, _attr), "set", _load_old_value, active_history=True)
+
+
+def fold_supplier_row(model, snapshot: dict, sign: int, deltas: dict) -> None:
+    """Add sign * one bill/payment to {supplier_id: {column: delta}}."""
+    if snapshot["supplier_id"] is None:
+        return
+    cols = deltas.setdefault(snapshot["supplier_id"], {})
+    col = SUPPLIER_FIELDS[model]
+    cols[col] = cols.get(col, 0) + sign * (snapshot["amount"] or 0)
+
+
+def apply_supplier_totals(deltas: dict) -> None:
+    """Add {supplier_id: {column: delta}} to the supplier rows (no commit)."""
+    for supplier_id, cols in sorted(deltas.items()):
+        values = {
+            col: db.func.coalesce(getattr(Supplier, col), 0) + delta
+            for col, delta in cols.items() if delta
+        }
+        if not values:
+            continue
+        db.session.execute(
+            db.update(Supplier).where(Supplier.id == supplier_id).values(values),
+            execution_options={"synchronize_session": False},
+        )
+        # A loaded Supplier would keep showing the old figures
+        loaded = db.session.identity_map.get(db.session.identity_key(Supplier, supplier_id))
+        if loaded is not None:
+            db.session.expire(loaded, list(values))
+
+
+@event.listens_for(db.session, "before_flush")
+def track_supplier_totals(session, flush_context, instances):
+    """Fold bill/payment inserts, updates and deletes into their supplier's totals."""
+    deltas = {}
+    tracked = {model: ("supplier_id", "amount") for model in SUPPLIER_FIELDS}
+    for model, before, after in row_changes(session, tracked):
+        for snapshot, sign in ((before, -1), (after, 1)):
+            if snapshot is not None:
+                fold_supplier_row(model, snapshot, sign, deltas)
+    apply_supplier_totals(deltas)
+
+
+def live_supplier_totals() -> dict:
+    """{supplier_id: {"total_due", "total_paid"}} summed from bills and payments."""
+    live = {sid: {"total_due": 0, "total_paid": 0} for (sid,) in db.session.query(Supplier.id)}
+    for model, col in SUPPLIER_FIELDS.items():
+        for supplier_id, total in db.session.query(
+            model.supplier_id, db.func.sum(model.amount)
+        ).group_by(model.supplier_id):
+            if supplier_id in live:
+                live[supplier_id][col] = total or 0
+    return live
+
+
+def verify_supplier_totals(repair: bool = False) -> list:
+    """
+    Compare every supplier's stored totals with live sums.
+    Returns [(supplier_id, column, stored, live)] for every mismatch;
+    overwrites the drifted values and commits when repair=True.
+    """
+    stored = {
+        sid: {"total_due": due, "total_paid": paid}
+        for sid, due, paid in db.session.query(Supplier.id, Supplier.total_due, Supplier.total_paid)
+    }
+    mismatches = []
+    for supplier_id, live in live_supplier_totals().items():
+        for col, value in live.items():
+            current = stored.get(supplier_id, {}).get(col)
+            if current is None or abs(current - value) > 0.005:
+                mismatches.append((supplier_id, col, current, value))
+
+    if repair and mismatches:
+        repair_supplier_totals(mismatches)
+        db.session.commit()
+    return mismatches
+
+
+def repair_supplier_totals(mismatches) -> None:
+    """Write the live values of verify_supplier_totals() mismatches (no commit)."""
+    for supplier_id, col, _, value in mismatches:
+        db.session.execute(
+            db.update(Supplier).where(Supplier.id == supplier_id).values({col: value})
+        )
+
+
+# ============================================================
+#  Request SQL Instrumentation (Server-Timing, N+1 detection)
+# ============================================================
+
+SQL_SLOWEST_KEEP = 3                # slowest statements kept per request
+SQL_REPEAT_LIMIT = int(os.getenv("SQL_REPEAT_LIMIT", "5"))      # same statement this often = N+1
+SQL_SLOW_REQUEST_MS = float(os.getenv("SQL_SLOW_REQUEST_MS", "500"))
+SQL_STATS_KEEP = int(os.getenv("SQL_STATS_KEEP", "200"))        # requests kept per endpoint
+SQL_LOG_ALL = os.getenv("SQL_LOG") == "1"
+
+# endpoint -> recent request summaries (per process)
+SQL_STATS = {}
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|:\w+)\s*,?)+\)")
+_NUMBER = re.compile(r"\b\d+\b")
+_SPACE = re.compile(r"\s+")
+
+
+def sql_fingerprint(statement: str) -> str:
+    """Statement with whitespace, numbers and IN-list lengths normalised."""
+    statement = _SPACE.sub(" ", statement).strip()
+    statement = _IN_LIST.sub("(?)", statement)
+    return _NUMBER.sub("N", statement)
+
+
+@dataclass
+class RequestSqlStats:
+    started: float = field(default_factory=time.perf_counter)
+    count: int = 0
+    seconds: float = 0.0
+    slowest: list = field(default_factory=list)        # (seconds, statement)
+    fingerprints: dict = field(default_factory=dict)   # fingerprint -> count
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        fp = sql_fingerprint(statement)
+        self.fingerprints[fp] = self.fingerprints.get(fp, 0) + 1
+        self.slowest.append((seconds, fp))
+        self.slowest.sort(key=lambda item: item[0], reverse=True)
+        del self.slowest[SQL_SLOWEST_KEEP:]
+
+    @property
+    def repeated(self) -> list:
+        """(count, fingerprint) of statements run SQL_REPEAT_LIMIT+ times."""
+        return sorted(
+            ((n, fp) for fp, n in self.fingerprints.items() if n >= SQL_REPEAT_LIMIT),
+            reverse=True,
+        )
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info["query_started"].pop()
+    if has_request_context():
+        stats = g.get("sql_stats")
+        if stats is not None:
+            stats.record(statement, time.perf_counter() - started)
+
+
+def _handle_db_error(exception_context):
+    started = exception_context.connection.info.get("query_started") \
+        if exception_context.connection is not None else None
+    if started:
+        started.pop()
+
+
+with app.app_context():
+    event.listen(db.engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(db.engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(db.engine, "handle_error", _handle_db_error)
+
+
+@app.before_request
+def start_sql_stats():
+    g.sql_stats = RequestSqlStats()
+
+
+def _finish_sql_stats(stats: RequestSqlStats, endpoint: str, method: str,
+                      path: str, status: int):
+    """Store the request summary and log it if slow, repetitive or SQL_LOG=1."""
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    summary = {
+        "endpoint": endpoint,
+        "method": method,
+        "path": path,
+        "status": status,
+        "queries": stats.count,
+        "db_ms": round(stats.seconds * 1000, 2),
+        "total_ms": round(total_ms, 2),
+        "repeated": [[n, fp[:200]] for n, fp in stats.repeated],
+        "slowest": [[round(sec * 1000, 2), fp[:200]] for sec, fp in stats.slowest],
+    }
+    SQL_STATS.setdefault(endpoint, deque(maxlen=SQL_STATS_KEEP)).append(summary)
+
+    if SQL_LOG_ALL or summary["repeated"] or total_ms >= SQL_SLOW_REQUEST_MS:
+        print("sql-stats " + json.dumps(summary), flush=True)
+
+
+@app.after_request
+def report_sql_stats(response):
+    stats = g.get("sql_stats")
+    if stats is None or request.endpoint in (None, "static"):
+        return response
+
+    total_ms = (time.perf_counter() - stats.started) * 1000
+    response.headers["Server-Timing"] = (
+        f'db;dur={stats.seconds * 1000:.2f};desc="{stats.count} queries", '
+        f"app;dur={total_ms:.2f}"
+    )
+
+    # Streamed pages keep querying after this point; summarise on close
+    args = (stats, request.endpoint, request.method, request.path, response.status_code)
+    if response.is_streamed:
+        response.call_on_close(lambda: _finish_sql_stats(*args))
+    else:
+        _finish_sql_stats(*args)
+    return response
+
+
+def sql_stats_by_endpoint() -> list:
+    """Per-endpoint aggregates over the kept requests, busiest DB time first."""
+    rows = []
+    for endpoint, items in SQL_STATS.items():
+        items = list(items)
+        n = len(items)
+        db_ms = sorted(i["db_ms"] for i in items)
+        slowest = max((s for i in items for s in i["slowest"]), default=None)
+        repeated = {}
+        for i in items:
+            for count, fp in i["repeated"]:
+                repeated[fp] = max(repeated.get(fp, 0), count)
+        rows.append({
+            "endpoint": endpoint,
+            "requests": n,
+            "avg_queries": sum(i["queries"] for i in items) / n,
+            "max_queries": max(i["queries"] for i in items),
+            "avg_db_ms": sum(db_ms) / n,
+            "p95_db_ms": db_ms[min(n - 1, int(n * 0.95))],
+            "avg_total_ms": sum(i["total_ms"] for i in items) / n,
+            "n_plus_one": sum(1 for i in items if i["repeated"]),
+            "repeated": sorted(repeated.items(), key=lambda kv: -kv[1])[:3],
+            "slowest": slowest,
+        })
+    rows.sort(key=lambda r: r["avg_db_ms"] * r["requests"], reverse=True)
+    return rows
+
+
 # ============================================================
 #  Auth Helpers
 # ============================================================
@@ -342,10 +1053,50 @@ def superadmin_required(view):
         return view(**kwargs)
     return wrapped_view
 
+# ------------------------------------------------------------
+# Logged-in identity, cached per process so requests skip the users table.
+# Any update/delete of a User row drops its entry; other workers pick the
+# change up within USER_CACHE_TTL seconds.
+# ------------------------------------------------------------
+
+USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "60"))
+_identity_cache = {}  # user_id -> (expires_at, CurrentUser or None)
+
+
+@dataclass(frozen=True)
+class CurrentUser:
+    """What g.user exposes: enough for auth checks and templates."""
+    id: int
+    username: str
+    role: str
+
+
+def cached_identity(user_id):
+    now = datetime.now().timestamp()
+    hit = _identity_cache.get(user_id)
+    if hit and hit[0] > now:
+        return hit[1]
+
+    user = db.session.get(User, user_id)
+    identity = CurrentUser(user.id, user.username, user.role) if user else None
+    _identity_cache[user_id] = (now + USER_CACHE_TTL, identity)
+    return identity
+
+
+def forget_identity(user_id):
+    _identity_cache.pop(user_id, None)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _forget_changed_user(mapper, connection, target):
+    forget_identity(target.id)
+
+
 @app.before_request
 def load_logged_in_user():
     user_id = session.get("user_id")
-    g.user = User.query.get(user_id) if user_id else None
+    g.user = cached_identity(user_id) if user_id else None
 
 
 # ============================================================
@@ -395,11 +1146,12 @@ def change_password():
         confirm_pass=request.form.get("confirm_password") or ""
         if not old_pass or not new_pass or not confirm_pass:
             flash("All fields are required"); return redirect(url_for("change_password"))
-        if not g.user.check_password(old_pass):
+        user = db.session.get(User, g.user.id)
+        if not user or not user.check_password(old_pass):
             flash("Old password incorrect"); return redirect(url_for("change_password"))
         if new_pass!=confirm_pass:
             flash("New password mismatch"); return redirect(url_for("change_password"))
-        g.user.set_password(new_pass); db.session.commit()
+        user.set_password(new_pass); db.session.commit()
         flash("Password updated"); return redirect(url_for("dashboard"))
     return render_template("change_password.html")
 
@@ -408,16 +1160,188 @@ def change_password():
 #  Utility Functions
 # ============================================================
 
+def _write_bank_balances(rows, running: float) -> float:
+    """
+    Walk ledger rows (id, date, credit, debit, balance_after) in chronological
+    order starting from `running` and bulk-UPDATE only the rows whose stored
+    balance_after is wrong. Returns the final running balance.
+
+    Only the months of the changed rows owe a TableVersion bump, so cached
+    statements of earlier months survive a later write.
+    """
+    changed = []
+    months = set()
+    for row in rows:
+        running += (row.credit or 0) - (row.debit or 0)
+        if row.balance_after != running:
+            changed.append({"id": row.id, "balance_after": running})
+            months.add(row.date.strftime("%Y-%m"))
+
+    if changed:
+        db.session.execute(
+            db.update(BalanceEntry), changed,
+            execution_options={"versions_tracked": True},
+        )
+        _pending_versions(db.session()).update(
+            (BalanceEntry.__tablename__, month) for month in months
+        )
+    return running
+
+
+def rebalance_bank_from(start_date, start_id: int = 0) -> None:
+    """
+    Recompute balance_after for bank entries at or after (start_date, start_id).
+
+    The running balance is seeded from the stored balance_after of the entry
+    just before that point, so only the affected suffix of the ledger is read.
+    Pass start_id=0 to rebalance the whole of start_date. No commit here.
+    """
+    db.session.flush()
+
+    # Row-value comparison so both queries are range scans on (date, id)
+    position = db.tuple_(BalanceEntry.date, BalanceEntry.id)
+    prev = db.session.query(BalanceEntry.balance_after).filter(
+        position < (start_date, start_id)
+    ).order_by(
+        BalanceEntry.date.desc(), BalanceEntry.id.desc()
+    ).first()
+    running = (prev.balance_after or 0) if prev else 0.0
+
+    rows = db.session.query(
+        BalanceEntry.id,
+        BalanceEntry.date,
+        BalanceEntry.credit,
+        BalanceEntry.debit,
+        BalanceEntry.balance_after,
+    ).filter(
+        position >= (start_date, start_id)
+    ).order_by(
+        BalanceEntry.date, BalanceEntry.id
+    ).all()
+
+    _write_bank_balances(rows, running)
+
+
 def recalc_bank_balances():
-    """Recompute balance_after for all bank entries in chronological order."""
-    entries = BalanceEntry.query.order_by(BalanceEntry.date, BalanceEntry.id).all()
-    running = 0.0
-    for e in entries:
-        running += (e.credit or 0) - (e.debit or 0)
-        e.balance_after = running
+    """
+    Recompute balance_after for all bank entries in chronological order.
+    Full rebuild used for repair; normal writes go through rebalance_bank_from().
+    """
+    db.session.flush()
+    rows = db.session.query(
+        BalanceEntry.id,
+        BalanceEntry.date,
+        BalanceEntry.credit,
+        BalanceEntry.debit,
+        BalanceEntry.balance_after,
+    ).order_by(
+        BalanceEntry.date, BalanceEntry.id
+    ).all()
+    _write_bank_balances(rows, 0.0)
     db.session.commit()
 
 
+PAGE_SIZE = 50
+
+
+def keyset_page(query, key_col, id_col, cursor=None, page_size: int = PAGE_SIZE) -> tuple:
+    """
+    One page of `query`, newest first by (key_col, id_col), starting after
+    `cursor` ("<iso value>_<id>" of the last row already shown).
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    An unreadable cursor just gives the first page.
+    """
+    if cursor:
+        try:
+            value_str, id_str = cursor.rsplit("_", 1)
+            value = key_col.type.python_type.fromisoformat(value_str)
+            query = query.filter(db.tuple_(key_col, id_col) < (value, int(id_str)))
+        except ValueError:
+            pass
+
+    rows = query.order_by(key_col.desc(), id_col.desc()).limit(page_size + 1).all()
+
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = f"{getattr(last, key_col.key).isoformat()}_{getattr(last, id_col.key)}"
+    return rows, next_cursor
+
+
+def list_query(model):
+    """
+    model.query with created_by joined into the same SELECT. Use it for
+    every list a template prints "added by" for, so the page costs a
+    fixed number of queries instead of a lazy users lookup per row.
+    """
+    return model.query.options(db.joinedload(model.created_by))
+
+
+STREAM_BATCH = 500     # rows fetched per round trip while streaming
+STREAM_CHUNK = 8192    # bytes of HTML buffered before each write
+
+
+class RowStream:
+    """
+    Rows of `query` read in batches through a server-side cursor
+    (yield_per), for templates that loop over them once. Truthiness only
+    peeks at the first row; len() works when the row count is passed in.
+    """
+
+    def __init__(self, query, count=None, batch: int = STREAM_BATCH):
+        self._query = query.yield_per(batch)
+        self._rows = None
+        self._head = []
+        self._count = count
+
+    def _iter_rows(self):
+        if self._rows is None:
+            self._rows = iter(self._query)
+        return self._rows
+
+    def __bool__(self):
+        if not self._head:
+            try:
+                self._head.append(next(self._iter_rows()))
+            except StopIteration:
+                return False
+        return True
+
+    def __iter__(self):
+        rows = self._iter_rows()
+        head, self._head = self._head, []
+        yield from head
+        yield from rows
+
+    def __len__(self):
+        if self._count is None:
+            raise TypeError("row count was not given for this stream")
+        return self._count
+
+
+def stream_page(template_name: str, **context):
+    """
+    Send `template_name` as a streamed response: HTML goes out in
+    STREAM_CHUNK pieces while any RowStream in the context is still
+    being read, so memory stays flat however long the page is.
+    """
+    parts = stream_template(template_name, **context)
+
+    def chunks():
+        buf, size = [], 0
+        for part in parts:
+            buf.append(part)
+            size += len(part)
+            if size >= STREAM_CHUNK:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+
+    return app.response_class(chunks(), mimetype="text/html")
+
+
 def log_delete(entity_type: str, entity_id: int, description: str):
     """Create a delete-log entry (no commit here)."""
     user_id = getattr(g.user, "id", None)
@@ -433,35 +1357,219 @@ def log_delete(entity_type: str, entity_id: int, description: str):
     db.session.add(entry)
 
 
+# ------------------------------------------------------------
+# Salary timeline: every StaffMonthlySalary change, per staff, sorted by
+# month, held in this process. A month's effective salary is a bisect
+# instead of a query. The timeline is rebuilt when the
+# staff_monthly_salaries TableVersion counter moves, so a change saved
+# by any worker (set_monthly_salary, imports, deletes) is seen on the
+# next lookup.
+# ------------------------------------------------------------
+
+@dataclass(frozen=True)
+class SalaryChange:
+    """One StaffMonthlySalary row as the timeline keeps it."""
+    id: int
+    year: int
+    month: int
+    salary: float
+    note: str
+
+
+@dataclass(frozen=True)
+class SalaryTimeline:
+    version: int
+    months: dict    # staff_id -> [year * 12 + month, ...] ascending
+    changes: dict   # staff_id -> [SalaryChange, ...] in the same order
+
+    def change_for(self, staff_id: int, year: int, month: int):
+        """Latest change effective on or before year/month, or None."""
+        months = self.months.get(staff_id)
+        if not months:
+            return None
+        pos = bisect_right(months, year * 12 + month)
+        return self.changes[staff_id][pos - 1] if pos else None
+
+
+_salary_timeline = None
+_salary_timeline_lock = threading.Lock()
+
+
+def salary_timeline() -> SalaryTimeline:
+    """The current timeline: one counter query, plus one load when it changed."""
+    global _salary_timeline
+    version = db.session.query(
+        db.func.coalesce(db.func.sum(TableVersion.version), 0)
+    ).filter(
+        TableVersion.table_name == StaffMonthlySalary.__tablename__
+    ).scalar()
+
+    timeline = _salary_timeline
+    if timeline is not None and timeline.version == version:
+        return timeline
+
+    with _salary_timeline_lock:
+        if _salary_timeline is not None and _salary_timeline.version == version:
+            return _salary_timeline
+        months, changes = {}, {}
+        rows = db.session.query(
+            StaffMonthlySalary.staff_id, StaffMonthlySalary.id,
+            StaffMonthlySalary.year, StaffMonthlySalary.month,
+            StaffMonthlySalary.salary, StaffMonthlySalary.note,
+        ).order_by(
+            StaffMonthlySalary.staff_id, StaffMonthlySalary.year, StaffMonthlySalary.month
+        )
+        for staff_id, record_id, year, month, salary, note in rows:
+            months.setdefault(staff_id, []).append(year * 12 + month)
+            changes.setdefault(staff_id, []).append(
+                SalaryChange(record_id, year, month, salary, note)
+            )
+        _salary_timeline = SalaryTimeline(version, months, changes)
+        return _salary_timeline
+
+
 def get_staff_salary_for_month(staff, year: int, month: int) -> tuple:
     """
     Get the effective salary for a staff member for a specific month.
-    Returns (salary, salary_record_or_None).
+    Returns (salary, SalaryChange_or_None).
     
     Finds the most recent salary change that is effective for the given month
     (year/month <= requested year/month). If no change exists, returns base salary.
     """
-    # Find the most recent salary change effective on or before the requested month
-    # Order by year DESC, month DESC to get the most recent one first
-    salary_record = StaffMonthlySalary.query.filter(
-        StaffMonthlySalary.staff_id == staff.id,
-        db.or_(
-            StaffMonthlySalary.year < year,
-            db.and_(
-                StaffMonthlySalary.year == year,
-                StaffMonthlySalary.month <= month
-            )
-        )
-    ).order_by(
-        StaffMonthlySalary.year.desc(),
-        StaffMonthlySalary.month.desc()
-    ).first()
-    
+    salary_record = salary_timeline().change_for(staff.id, year, month)
     if salary_record:
         return salary_record.salary, salary_record
     return staff.salary or 0, None
 
 
+def month_bounds(year: int, month: int) -> tuple:
+    """First and last date of a calendar month."""
+    start = datetime(year, month, 1).date()
+    if month == 12:
+        next_start = datetime(year + 1, 1, 1).date()
+    else:
+        next_start = datetime(year, month + 1, 1).date()
+    return start, next_start - timedelta(days=1)
+
+
+def get_staff_salaries_for_month(staff_ids, year: int, month: int) -> dict:
+    """
+    Batched get_staff_salary_for_month() plus the month's payments.
+
+    Returns {staff_id: {"effective_salary", "salary_record", "total_paid",
+    "payments"}} with a fixed number of queries however many staff are passed:
+      - base salaries of those staff; changes come from salary_timeline()
+      - all payments of those staff in the month (newest first)
+    """
+    staff_ids = list(staff_ids)
+    if not staff_ids:
+        return {}
+
+    timeline = salary_timeline()
+    base_salaries = db.session.query(Staff.id, Staff.salary).filter(Staff.id.in_(staff_ids))
+
+    result = {}
+    for staff_id, base_salary in base_salaries:
+        salary_record = timeline.change_for(staff_id, year, month)
+        result[staff_id] = {
+            "effective_salary": salary_record.salary if salary_record else (base_salary or 0),
+            "salary_record": salary_record,
+            "total_paid": 0,
+            "payments": [],
+        }
+
+    start_date, end_date = month_bounds(year, month)
+    payments = list_query(StaffPayment).filter(
+        StaffPayment.staff_id.in_(staff_ids),
+        StaffPayment.date >= start_date,
+        StaffPayment.date <= end_date,
+    ).order_by(
+        StaffPayment.date.desc(), StaffPayment.id.desc()
+    ).all()
+    for p in payments:
+        info = result.get(p.staff_id)
+        if info is not None:
+            info["payments"].append(p)
+            info["total_paid"] += p.amount or 0
+
+    return result
+
+
+PAYROLL_LEDGER_MAX_MONTHS = 36
+
+
+def months_between(first: date, last: date) -> list:
+    """(year, month) of every calendar month from `first` to `last`, inclusive."""
+    months = []
+    index, end = first.year * 12 + first.month - 1, last.year * 12 + last.month - 1
+    while index <= end:
+        months.append((index // 12, index % 12 + 1))
+        index += 1
+    return months
+
+
+def payroll_ledger(staff_list, months) -> dict:
+    """
+    Salary vs paid for every staff and month in `months` ([(year, month)]),
+    with unpaid salary carried forward from month to month.
+
+    One grouped query sums StaffPayment by (staff_id, year, month); the
+    effective salaries come from salary_timeline(), so the cost does not
+    grow with the number of staff. Returns {"months", "rows", "totals"}:
+    each row holds a cell per month (salary, paid, arrears) and the row
+    totals; "totals" the same per month across all staff.
+    """
+    first, last = months[0], months[-1]
+    start_date = month_bounds(*first)[0]
+    end_date = month_bounds(*last)[1]
+
+    pay_year = db.extract("year", StaffPayment.date)
+    pay_month = db.extract("month", StaffPayment.date)
+    paid_rows = db.session.query(
+        StaffPayment.staff_id, pay_year, pay_month, db.func.sum(StaffPayment.amount)
+    ).filter(
+        StaffPayment.date >= start_date,
+        StaffPayment.date <= end_date,
+    ).group_by(StaffPayment.staff_id, pay_year, pay_month)
+    paid = {
+        (staff_id, int(year), int(month)): amount or 0
+        for staff_id, year, month, amount in paid_rows
+    }
+
+    timeline = salary_timeline()
+    totals = [{"salary": 0, "paid": 0, "arrears": 0} for _ in months]
+    rows = []
+    for staff in staff_list:
+        cells, arrears, salary_sum, paid_sum = [], 0, 0, 0
+        for i, (year, month) in enumerate(months):
+            change = timeline.change_for(staff.id, year, month)
+            salary = change.salary if change else (staff.salary or 0)
+            paid_month = paid.get((staff.id, year, month), 0)
+            arrears += salary - paid_month
+            salary_sum += salary
+            paid_sum += paid_month
+            cells.append({"salary": salary, "paid": paid_month, "arrears": arrears})
+            totals[i]["salary"] += salary
+            totals[i]["paid"] += paid_month
+            totals[i]["arrears"] += arrears
+        rows.append({
+            "staff": staff,
+            "cells": cells,
+            "salary": salary_sum,
+            "paid": paid_sum,
+            "arrears": arrears,
+        })
+
+    return {
+        "months": months,
+        "rows": rows,
+        "totals": totals,
+        "salary": sum(t["salary"] for t in totals),
+        "paid": sum(t["paid"] for t in totals),
+        "arrears": totals[-1]["arrears"],
+    }
+
+
 # ============================================================
 #  Dashboard & Core Finance Routes
 # ============================================================
@@ -497,32 +1605,31 @@ def dashboard():
         days_start = first_of_month
         days_end = today
 
-    days = DaySummary.query.filter(
+    days = list_query(DaySummary).filter(
         DaySummary.date >= days_start,
         DaySummary.date <= days_end,
     ).order_by(DaySummary.date.desc()).all()
 
-    # Lab collections in same range
-    lab_rows_range = LabCollection.query.filter(
-        LabCollection.date >= days_start,
-        LabCollection.date <= days_end,
+    # Daily rollups in same range (lab amount per day + range total)
+    rollups_range = DailyRollup.query.filter(
+        DailyRollup.date >= days_start,
+        DailyRollup.date <= days_end,
     ).all()
-    lab_by_date = {r.date: r for r in lab_rows_range}
-    total_lab_range = sum(r.amount or 0 for r in lab_rows_range)
+    rollup_by_date = {r.date: r for r in rollups_range}
 
     # total collection (normal + lab) for the range
-    total_collection_range = (
-        sum(d.total_collection or 0 for d in days) + total_lab_range
+    total_collection_range = sum(
+        (r.total_collection or 0) + (r.total_lab or 0) for r in rollups_range
     )
 
     # --------------------------------------------------
     # 2) Total expenses card: current month only
     # --------------------------------------------------
     total_expenses_month = db.session.query(
-        db.func.sum(Expense.amount)
+        db.func.sum(DailyRollup.total_expenses)
     ).filter(
-        Expense.date >= first_of_month,
-        Expense.date <= today,
+        DailyRollup.date >= first_of_month,
+        DailyRollup.date <= today,
     ).scalar() or 0
 
     # --------------------------------------------------
@@ -542,47 +1649,18 @@ def dashboard():
         exp_start = today
         exp_end = today
 
-    expenses = Expense.query.filter(
+    expenses = list_query(Expense).filter(
         Expense.date >= exp_start,
         Expense.date <= exp_end,
     ).order_by(Expense.date.desc(), Expense.id.desc()).all()
 
-    # Doctor bills – still loaded, even if not used much
-    total_doctor_bills_all = db.session.query(
-        db.func.sum(DoctorBill.amount)
-    ).scalar() or 0
-    doctor_bills = DoctorBill.query.order_by(
-        DoctorBill.date.desc(), DoctorBill.id.desc()
-    ).all()
-
     # --------------------------------------------------
-    # 4) Cash in hand & bank from all-time data
+    # 4) Cash in hand & bank from the running totals row
     # --------------------------------------------------
-    total_collection_all_normal = db.session.query(
-        db.func.sum(DaySummary.total_collection)
-    ).scalar() or 0
-
-    total_lab_all = db.session.query(
-        db.func.sum(LabCollection.amount)
-    ).scalar() or 0
-
-    total_collection_all = total_collection_all_normal + total_lab_all
-
-    total_expenses_all = db.session.query(
-        db.func.sum(Expense.amount)
-    ).scalar() or 0
-
-    total_wealth = total_collection_all - total_expenses_all - total_doctor_bills_all
-
-    bank_credits = db.session.query(
-        db.func.sum(BalanceEntry.credit)
-    ).scalar() or 0
-    bank_debits = db.session.query(
-        db.func.sum(BalanceEntry.debit)
-    ).scalar() or 0
-    bank_balance = bank_credits - bank_debits
-
-    cash_in_hand = total_wealth - bank_balance
+    totals = get_ledger_totals()
+    total_doctor_bills_all = totals.total_doctor_bills
+    bank_balance = totals.bank_balance
+    cash_in_hand = totals.cash_in_hand
 
     return render_template(
         "dashboard.html",
@@ -603,11 +1681,8 @@ def dashboard():
         exp_start=exp_start,
         exp_end=exp_end,
 
-        # Doctor bills table
-        doctor_bills=doctor_bills,
-
-        # Lab collections by date for table display
-        lab_by_date=lab_by_date,
+        # Daily rollups by date (lab column) for table display
+        rollup_by_date=rollup_by_date,
     )
 
 
@@ -732,7 +1807,7 @@ def lab_collection():
         return redirect(url_for("lab_collection"))
 
     # GET: show recent lab rows
-    recent = LabCollection.query.order_by(
+    recent = list_query(LabCollection).order_by(
         LabCollection.date.desc(), LabCollection.id.desc()
     ).limit(30).all()
 
@@ -845,6 +1920,133 @@ def add_doctor_bill():
 #  Delete Routes (Admin Only)
 # ============================================================
 
+IN_CHUNK = 500   # ids per IN (...) list, well under every driver's parameter limit
+
+
+def _id_chunks(ids):
+    ids = sorted(ids)
+    for i in range(0, len(ids), IN_CHUNK):
+        yield ids[i:i + IN_CHUNK]
+
+
+@dataclass
+class CascadeSummary:
+    """What cascade_delete() removed, for the flash message and delete log."""
+    expenses: int = 0
+    expense_amount: float = 0
+    staff_payments: int = 0
+    supplier_payments: int = 0
+    payment_amount: float = 0
+    bank_entries: int = 0
+    bank_amount: float = 0
+    supplier_bills: int = 0
+    bill_amount: float = 0
+
+    def describe(self) -> str:
+        parts = []
+        if self.supplier_bills:
+            parts.append(f"{self.supplier_bills} bill(s) {self.bill_amount:.2f}")
+        payments = self.staff_payments + self.supplier_payments
+        if payments:
+            parts.append(f"{payments} payment(s) {self.payment_amount:.2f}")
+        if self.expenses:
+            parts.append(f"{self.expenses} expense(s) {self.expense_amount:.2f}")
+        if self.bank_entries:
+            parts.append(f"{self.bank_entries} bank entr{'y' if self.bank_entries == 1 else 'ies'} "
+                         f"{self.bank_amount:.2f}")
+        return ", ".join(parts) + " BDT" if parts else "nothing linked"
+
+
+def cascade_delete(expense_ids=(), supplier_ids=()) -> CascadeSummary:
+    """
+    Set-based delete of expenses and suppliers with everything linked:
+      - expense_ids: those expenses, the staff/supplier payments that
+        created them and those payments' bank entries
+      - supplier_ids: those suppliers, their bills and payments, and the
+        payments' expenses and bank entries
+
+    Linked ids are collected with one query per table and removed with
+    DELETE ... WHERE id IN (...). Bulk deletes skip the flush hooks, so
+    the ledger/rollup and supplier deltas are applied here, and bank balances are
+    rebalanced once from the earliest deleted bank entry. No commit.
+    """
+    summary = CascadeSummary()
+    expense_ids, supplier_ids = set(expense_ids), set(supplier_ids)
+    db.session.flush()
+
+    # --- collect ids: payments first, they point at expenses and bank entries ---
+    payment_ids = {StaffPayment: set(), SupplierPayment: set()}
+    bank_ids = set()
+    supplier_deltas = {}   # suppliers that stay lose the deleted payments
+    for model in (StaffPayment, SupplierPayment):
+        owner = model.expense_id.in_(expense_ids)
+        owner_id = model.supplier_id if model is SupplierPayment else model.staff_id
+        if model is SupplierPayment and supplier_ids:
+            owner = db.or_(owner, model.supplier_id.in_(supplier_ids))
+        for pid, expense_id, bank_entry_id, amount, owner_key in db.session.query(
+            model.id, model.expense_id, model.bank_entry_id, model.amount, owner_id
+        ).filter(owner):
+            payment_ids[model].add(pid)
+            summary.payment_amount += amount or 0
+            if model is SupplierPayment and owner_key not in supplier_ids:
+                fold_supplier_row(model, {"supplier_id": owner_key, "amount": amount},
+                                  -1, supplier_deltas)
+            if expense_id:
+                expense_ids.add(expense_id)
+            if bank_entry_id:
+                bank_ids.add(bank_entry_id)
+    summary.staff_payments = len(payment_ids[StaffPayment])
+    summary.supplier_payments = len(payment_ids[SupplierPayment])
+
+    # --- ledger rows: read what the totals and rollups must lose ---
+    deltas = ({}, {}, {})   # totals, daily, by_category
+    expense_rows = []
+    for chunk in _id_chunks(expense_ids):
+        expense_rows += db.session.query(
+            Expense.id, Expense.date, Expense.category, Expense.amount
+        ).filter(Expense.id.in_(chunk)).all()
+    for row in expense_rows:
+        fold_ledger_row(Expense, row._asdict(), -1, *deltas)
+        summary.expense_amount += row.amount or 0
+    summary.expenses = len(expense_rows)
+
+    bank_rows = []
+    for chunk in _id_chunks(bank_ids):
+        bank_rows += db.session.query(
+            BalanceEntry.id, BalanceEntry.date, BalanceEntry.credit, BalanceEntry.debit
+        ).filter(BalanceEntry.id.in_(chunk)).all()
+    for row in bank_rows:
+        fold_ledger_row(BalanceEntry, row._asdict(), -1, *deltas)
+        summary.bank_amount += (row.credit or 0) + (row.debit or 0)
+    summary.bank_entries = len(bank_rows)
+
+    if supplier_ids:
+        summary.supplier_bills, summary.bill_amount = db.session.query(
+            db.func.count(SupplierBill.id), db.func.coalesce(db.func.sum(SupplierBill.amount), 0)
+        ).filter(SupplierBill.supplier_id.in_(supplier_ids)).one()
+
+    # --- delete, children before parents ---
+    for model, ids in (
+        (StaffPayment, payment_ids[StaffPayment]),
+        (SupplierPayment, payment_ids[SupplierPayment]),
+        (Expense, {r.id for r in expense_rows}),
+        (BalanceEntry, {r.id for r in bank_rows}),
+    ):
+        for chunk in _id_chunks(ids):
+            db.session.execute(db.delete(model).where(model.id.in_(chunk)))
+    if supplier_ids:
+        db.session.execute(db.delete(SupplierBill).where(SupplierBill.supplier_id.in_(supplier_ids)))
+        db.session.execute(db.delete(Supplier).where(Supplier.id.in_(supplier_ids)))
+
+    totals, daily, by_category = deltas
+    apply_ledger_totals(totals)
+    apply_daily_rollups(daily, by_category)
+    apply_supplier_totals(supplier_deltas)
+    if bank_rows:
+        rebalance_bank_from(min(r.date for r in bank_rows))
+    return summary
+
+
 @app.route("/day/<int:day_id>/delete", methods=["POST"])
 @admin_required
 def delete_day(day_id):
@@ -866,41 +2068,14 @@ def delete_expense(expense_id):
     those are also removed and bank balances recalculated.
     """
     exp = Expense.query.get_or_404(expense_id)
+    description = f"Deleted expense '{exp.category}' {exp.amount:.2f} BDT on {exp.date}"
 
-    log_delete(
-        "expense",
-        exp.id,
-        f"Deleted expense '{exp.category}' {exp.amount:.2f} BDT on {exp.date}",
-    )
-
-    touched_bank = False
-
-    # Staff payments linked to this expense
-    staff_payments = StaffPayment.query.filter_by(expense_id=exp.id).all()
-    for p in staff_payments:
-        if p.bank_entry_id:
-            be = BalanceEntry.query.get(p.bank_entry_id)
-            if be:
-                db.session.delete(be)
-                touched_bank = True
-        db.session.delete(p)
-
-    # Supplier payments linked to this expense
-    supplier_payments = SupplierPayment.query.filter_by(expense_id=exp.id).all()
-    for sp in supplier_payments:
-        if sp.bank_entry_id:
-            be = BalanceEntry.query.get(sp.bank_entry_id)
-            if be:
-                db.session.delete(be)
-                touched_bank = True
-        db.session.delete(sp)
-
-    db.session.delete(exp)
+    summary = cascade_delete(expense_ids=[exp.id])
+    if summary.expenses > 1 or summary.staff_payments or summary.supplier_payments:
+        description += f" with {summary.describe()}"
+    log_delete("expense", expense_id, description)
     db.session.commit()
 
-    if touched_bank:
-        recalc_bank_balances()
-
     flash("Expense deleted.")
     return redirect(url_for("dashboard"))
 
@@ -945,6 +2120,11 @@ def empty_database():
         DeleteLog.query.delete()
         LabCollection.query.delete()
 
+        # Bulk deletes bypass the flush hook, so reset totals and rollups too
+        DailyRollup.query.delete()
+        DailyExpenseRollup.query.delete()
+        rebuild_ledger_totals()
+
         db.session.commit()
         flash("All financial records have been permanently deleted.", "warning")
     except Exception as e:
@@ -954,6 +2134,822 @@ def empty_database():
     return redirect(url_for("dashboard"))
 
 
+# ============================================================
+#  Report Engine – one aggregate scan per table
+# ============================================================
+
+REPORT_TYPES = {
+    "all": ("collection", "expenses", "doctor_bills"),
+    "collection": ("collection",),
+    "expenses": ("expenses",),
+    "doctor_bills": ("doctor_bills",),
+}
+
+
+def grouped_totals(query, keys, measures, skip_zero: bool = False) -> tuple:
+    """
+    Sum `measures` over `query` grouped by `keys`, plus the grand total,
+    in one scan. Returns (groups, total): groups is a list of
+    (*keys, *sums) tuples ordered by keys, total a tuple of sums.
+
+    PostgreSQL gets both from GROUPING SETS ((keys), ()). SQLite has no
+    grouping sets, so there the total is added up from the groups.
+    skip_zero drops groups whose sums are all zero (rollups can net out).
+    """
+    sums = [db.func.coalesce(db.func.sum(m), 0) for m in measures]
+    n = len(keys)
+
+    if db.engine.dialect.name == "postgresql":
+        rows = (
+            query.with_entities(*keys, *sums, db.func.grouping(*keys))
+            .group_by(db.func.grouping_sets(db.tuple_(*keys), db.tuple_()))
+            .order_by(*keys)
+            .all()
+        )
+        groups = [tuple(r[:-1]) for r in rows if not r[-1]]
+        total = next(
+            (tuple(r[n:-1]) for r in rows if r[-1]),
+            (0,) * len(measures),
+        )
+    else:
+        groups = [
+            tuple(r)
+            for r in query.with_entities(*keys, *sums)
+            .group_by(*keys)
+            .order_by(*keys)
+            .all()
+        ]
+        total = tuple(
+            sum(r[n + i] for r in groups) for i in range(len(measures))
+        )
+
+    if skip_zero:
+        groups = [r for r in groups if any(r[n:])]
+    return groups, total
+
+
+@dataclass
+class FinanceReport:
+    """Everything finance_report_pdf.html shows for one date range."""
+    start_date: date
+    end_date: date
+    report_type: str = "all"
+    expense_category: str = ""
+
+    days: list = field(default_factory=list)
+    lab_by_date: dict = field(default_factory=dict)
+    expenses_list: list = field(default_factory=list)
+    doctor_bills_list: list = field(default_factory=list)
+
+    total_normal_collection: float = 0
+    total_lab: float = 0
+    total_expenses: float = 0
+    total_doctor_bills: float = 0
+
+    expense_breakdown: list = field(default_factory=list)  # (category, total)
+    doctor_breakdown: list = field(default_factory=list)   # (doctor, modality, total)
+
+    @property
+    def sections(self) -> tuple:
+        return REPORT_TYPES.get(self.report_type, ())
+
+    @property
+    def include_collection(self) -> bool:
+        return "collection" in self.sections
+
+    @property
+    def include_expenses(self) -> bool:
+        return "expenses" in self.sections
+
+    @property
+    def include_doctor_bills(self) -> bool:
+        return "doctor_bills" in self.sections
+
+    @property
+    def total_collection(self) -> float:
+        return self.total_normal_collection + self.total_lab
+
+    @property
+    def net_cash(self):
+        """Only meaningful when everything is included and no category filter."""
+        if len(self.sections) < 3 or self.expense_category:
+            return None
+        return self.total_collection - self.total_expenses - self.total_doctor_bills
+
+
+def build_finance_report(start_date, end_date, report_type: str = "all",
+                         expense_category: str = "", stream: bool = False) -> FinanceReport:
+    """
+    Build a FinanceReport. Totals and breakdowns come from one grouped
+    query per source table (daily_rollups, daily_expense_rollups,
+    doctor_bills); the row lists are one plain range query each.
+    With stream=True the row lists are RowStreams instead of lists.
+    """
+    rep = FinanceReport(start_date, end_date, report_type, expense_category)
+    rows = RowStream if stream else (lambda query: query.all())
+
+    # Collections, lab and doctor bill totals all live in daily_rollups
+    if rep.include_collection or rep.include_doctor_bills:
+        per_day, (normal, lab, doctor) = grouped_totals(
+            DailyRollup.query.filter(
+                DailyRollup.date >= start_date,
+                DailyRollup.date <= end_date,
+            ),
+            [DailyRollup.date],
+            [DailyRollup.total_collection, DailyRollup.total_lab,
+             DailyRollup.total_doctor_bills],
+        )
+        if rep.include_collection:
+            rep.total_normal_collection = normal
+            rep.total_lab = lab
+            rep.lab_by_date = {d: day_lab for d, _, day_lab, _ in per_day}
+        if rep.include_doctor_bills:
+            rep.total_doctor_bills = doctor
+
+    if rep.include_collection:
+        rep.days = rows(list_query(DaySummary).filter(
+            DaySummary.date >= start_date,
+            DaySummary.date <= end_date
+        ).order_by(DaySummary.date))
+
+    if rep.include_expenses:
+        expenses_query = list_query(Expense).filter(
+            Expense.date >= start_date,
+            Expense.date <= end_date
+        )
+        breakdown_query = DailyExpenseRollup.query.filter(
+            DailyExpenseRollup.date >= start_date,
+            DailyExpenseRollup.date <= end_date
+        )
+        if expense_category:
+            expenses_query = expenses_query.filter(Expense.category == expense_category)
+            breakdown_query = breakdown_query.filter(
+                DailyExpenseRollup.category == expense_category
+            )
+        rep.expenses_list = rows(expenses_query.order_by(Expense.date))
+
+        rep.expense_breakdown, (rep.total_expenses,) = grouped_totals(
+            breakdown_query,
+            [DailyExpenseRollup.category],
+            [DailyExpenseRollup.amount],
+            skip_zero=True,
+        )
+
+    if rep.include_doctor_bills:
+        bills_query = DoctorBill.query.filter(
+            DoctorBill.date >= start_date,
+            DoctorBill.date <= end_date
+        )
+        rep.doctor_bills_list = rows(bills_query.order_by(DoctorBill.date))
+        rep.doctor_breakdown, _ = grouped_totals(
+            bills_query,
+            [DoctorBill.doctor_name, DoctorBill.modality],
+            [DoctorBill.amount],
+        )
+
+    return rep
+
+
+# ============================================================
+#  PDF Documents – ReportLab, cached by content hash
+# ============================================================
+
+CLINIC_NAME = "Asia Doctor's Point"
+
+# Registered once at startup; Helvetica if the bundled font is missing
+PDF_FONT = "Helvetica"
+try:
+    pdfmetrics.registerFont(
+        TTFont("NotoSansBengali", os.path.join(app.root_path, "NotoSansBengali-Regular.ttf"))
+    )
+    PDF_FONT = "NotoSansBengali"
+except Exception as e:
+    print(f"⚠️  Bengali font not loaded, PDFs use Helvetica: {e}")
+
+PDF_CACHE_DIR = os.getenv(
+    "PDF_CACHE_DIR", os.path.join(tempfile.gettempdir(), "clinic_pdf_cache")
+)
+PDF_CACHE_MAX_FILES = 200
+PDF_WRAP_AT = 40   # table cells longer than this wrap
+
+
+@dataclass
+class PdfTable:
+    heading: str
+    columns: list
+    rows: list                                     # lists of display strings
+    total: list = None                             # optional bold last row
+    numeric: list = field(default_factory=list)    # right-aligned column indexes
+
+
+@dataclass
+class PdfDocument:
+    """Plain-text description of a printable document (hashable as JSON)."""
+    title: str
+    subtitle: str = CLINIC_NAME
+    meta: list = field(default_factory=list)       # lines under the title
+    summary: list = field(default_factory=list)    # (label, value) pairs
+    tables: list = field(default_factory=list)     # PdfTable
+
+
+def money(value) -> str:
+    return "%.2f" % (value or 0)
+
+
+def pdf_digest(doc: PdfDocument) -> str:
+    payload = json.dumps(asdict(doc), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def render_pdf(doc: PdfDocument, path: str):
+    """Lay out `doc` with platypus and write it to `path`."""
+    title_style = ParagraphStyle("title", fontName=PDF_FONT, fontSize=16, leading=20)
+    sub_style = ParagraphStyle("sub", fontName=PDF_FONT, fontSize=11, leading=14,
+                               textColor=colors.HexColor("#4b5563"))
+    text_style = ParagraphStyle("text", fontName=PDF_FONT, fontSize=9, leading=12)
+    heading_style = ParagraphStyle("heading", fontName=PDF_FONT, fontSize=12, leading=16,
+                                   spaceBefore=8, spaceAfter=4)
+
+    cell_style = ParagraphStyle("cell", fontName=PDF_FONT, fontSize=8.5, leading=10.5)
+
+    def cell(value):
+        # Long text gets a Paragraph so it wraps instead of widening the table
+        return Paragraph(escape(value), cell_style) if len(value) > PDF_WRAP_AT else value
+
+    story = [Paragraph(escape(doc.title), title_style),
+             Paragraph(escape(doc.subtitle), sub_style)]
+    story += [Paragraph(escape(line), text_style) for line in doc.meta]
+    story.append(Spacer(1, 4 * mm))
+
+    if doc.summary:
+        summary = Table([[label, value] for label, value in doc.summary],
+                        colWidths=[70 * mm, 50 * mm], hAlign="LEFT")
+        summary.setStyle(TableStyle([
+            ("FONT", (0, 0), (-1, -1), PDF_FONT, 10),
+            ("ALIGN", (1, 0), (1, -1), "RIGHT"),
+            ("LINEBELOW", (0, 0), (-1, -1), 0.25, colors.HexColor("#d1d5db")),
+        ]))
+        story += [summary, Spacer(1, 4 * mm)]
+
+    for t in doc.tables:
+        story.append(Paragraph(escape(t.heading), heading_style))
+        rows = [[cell(v) for v in row] for row in t.rows]
+        data = [t.columns] + (rows or [["No records"] + [""] * (len(t.columns) - 1)])
+        if t.total:
+            data.append(t.total)
+        table = Table(data, repeatRows=1, hAlign="LEFT")
+        style = [
+            ("FONT", (0, 0), (-1, -1), PDF_FONT, 8.5),
+            ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#e5e7eb")),
+            ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#9ca3af")),
+            ("VALIGN", (0, 0), (-1, -1), "TOP"),
+        ]
+        style += [("ALIGN", (i, 0), (i, -1), "RIGHT") for i in t.numeric]
+        if t.total:
+            style.append(("BACKGROUND", (0, -1), (-1, -1), colors.HexColor("#f3f4f6")))
+        table.setStyle(TableStyle(style))
+        story.append(table)
+
+    def footer(canvas, template):
+        canvas.saveState()
+        canvas.setFont(PDF_FONT, 8)
+        canvas.drawString(15 * mm, 10 * mm, f"{CLINIC_NAME} — {doc.title}")
+        canvas.drawRightString(A4[0] - 15 * mm, 10 * mm, f"Page {template.page}")
+        canvas.restoreState()
+
+    SimpleDocTemplate(
+        path, pagesize=A4, title=doc.title,
+        leftMargin=15 * mm, rightMargin=15 * mm, topMargin=15 * mm, bottomMargin=18 * mm,
+    ).build(story, onFirstPage=footer, onLaterPages=footer)
+
+
+def _prune_cache_dir(directory: str, suffix: str, keep: int):
+    """
+    Delete the oldest `suffix` files in `directory` beyond the newest `keep`.
+    Other workers prune the same directory, so files may vanish midway.
+    """
+    files = []
+    for name in os.listdir(directory):
+        if not name.endswith(suffix):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            files.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            continue
+    if len(files) <= keep:
+        return
+    files.sort()
+    for _, path in files[:len(files) - keep]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def send_pdf(doc: PdfDocument, filename: str):
+    """
+    Serve `doc` as a PDF download. Files are cached under PDF_CACHE_DIR by
+    the hash of their content, so an unchanged document is never laid out
+    twice. The bytes are read once and sent from memory, so a file pruned
+    by another worker in the meantime does not break the download.
+    """
+    digest = pdf_digest(doc)
+    path = os.path.join(PDF_CACHE_DIR, digest + ".pdf")
+
+    try:
+        with open(path, "rb") as fh:
+            data = fh.read()
+    except FileNotFoundError:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".pdf", dir=PDF_CACHE_DIR)
+        os.close(fd)
+        try:
+            render_pdf(doc, tmp_path)
+            with open(tmp_path, "rb") as fh:
+                data = fh.read()
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+        _prune_cache_dir(PDF_CACHE_DIR, ".pdf", PDF_CACHE_MAX_FILES)
+
+    return send_file(io.BytesIO(data), mimetype="application/pdf", download_name=filename)
+
+
+def wants_pdf() -> bool:
+    return request.form.get("format") == "pdf"
+
+
+def _period(start_date, end_date) -> str:
+    return f"Period: {start_date.strftime('%d/%m/%Y')} to {end_date.strftime('%d/%m/%Y')}"
+
+
+def _username(row) -> str:
+    return row.created_by.username if row.created_by else "—"
+
+
+def finance_report_pdf(rep: FinanceReport) -> PdfDocument:
+    doc = PdfDocument("Finance Summary Report", meta=[_period(rep.start_date, rep.end_date)])
+    if rep.expense_category:
+        doc.meta.append(f"Expense category: {rep.expense_category}")
+
+    if rep.include_collection:
+        doc.summary.append(("Total Collection (incl. lab)", money(rep.total_collection)))
+        if rep.total_lab:
+            doc.summary.append(("Lab Collection", money(rep.total_lab)))
+    if rep.include_expenses:
+        doc.summary.append(("Total Expenses", money(rep.total_expenses)))
+    if rep.include_doctor_bills:
+        doc.summary.append(("Total Doctor Bills", money(rep.total_doctor_bills)))
+    if rep.net_cash is not None:
+        doc.summary.append(("Net Cash", money(rep.net_cash)))
+
+    if rep.include_collection:
+        doc.tables.append(PdfTable(
+            "Daily Collection",
+            ["Date", "Collection", "Lab", "Notes", "By"],
+            [[d.date.strftime("%d/%m/%Y"), money(d.total_collection),
+              money(rep.lab_by_date.get(d.date, 0)), d.notes or "", _username(d)]
+             for d in rep.days],
+            numeric=[1, 2],
+        ))
+    if rep.include_expenses:
+        doc.tables.append(PdfTable(
+            "Expenses by Category",
+            ["Category", "Total"],
+            [[cat or "Uncategorized", money(total)] for cat, total in rep.expense_breakdown],
+            total=["Total", money(rep.total_expenses)],
+            numeric=[1],
+        ))
+        doc.tables.append(PdfTable(
+            "Expense Details",
+            ["Date", "Category", "Description", "Amount", "By"],
+            [[e.date.strftime("%d/%m/%Y"), e.category, e.description or "",
+              money(e.amount), _username(e)] for e in rep.expenses_list],
+            numeric=[3],
+        ))
+    if rep.include_doctor_bills:
+        doc.tables.append(PdfTable(
+            "Doctor Bills",
+            ["Date", "Doctor", "Modality", "Amount"],
+            [[b.date.strftime("%d/%m/%Y"), b.doctor_name or "", b.modality or "",
+              money(b.amount)] for b in rep.doctor_bills_list],
+            total=["Total", "", "", money(rep.total_doctor_bills)],
+            numeric=[3],
+        ))
+    return doc
+
+
+def bank_statement_pdf(start_date, end_date, opening_balance, closing_balance,
+                       period_credits, period_debits, entries, **_) -> PdfDocument:
+    return PdfDocument(
+        "Bank Transaction Statement",
+        meta=[_period(start_date, end_date)],
+        summary=[
+            ("Opening Balance", money(opening_balance)),
+            ("Total Credits", money(period_credits)),
+            ("Total Debits", money(period_debits)),
+            ("Closing Balance", money(closing_balance)),
+        ],
+        tables=[PdfTable(
+            "Transactions",
+            ["Date", "Description", "Credit", "Debit", "Balance", "By"],
+            [[e.date.strftime("%d/%m/%Y"), e.description or "",
+              money(e.credit) if e.credit else "-", money(e.debit) if e.debit else "-",
+              money(e.balance_after), _username(e)] for e in entries],
+            numeric=[2, 3, 4],
+        )],
+    )
+
+
+def supplier_report_pdf(supplier, start_date, end_date, bills, payments,
+                        total_bills_period, total_paid_period, opening_balance,
+                        closing_balance, total_bills_all, total_paid_all,
+                        balance_all, **_) -> PdfDocument:
+    return PdfDocument(
+        f"Supplier Report — {supplier.name}",
+        meta=[_period(start_date, end_date)],
+        summary=[
+            ("Opening Balance", money(opening_balance)),
+            ("Bills (period)", money(total_bills_period)),
+            ("Payments (period)", money(total_paid_period)),
+            ("Closing Balance", money(closing_balance)),
+            ("All-time Bills", money(total_bills_all)),
+            ("All-time Paid", money(total_paid_all)),
+            ("Current Balance", money(balance_all)),
+        ],
+        tables=[
+            PdfTable(
+                "Bills Received",
+                ["#", "Date", "Description", "Amount", "By"],
+                [[str(i), b.date.strftime("%d/%m/%Y"), b.description or "—",
+                  money(b.amount), _username(b)] for i, b in enumerate(bills, 1)],
+                total=["", "", "Total Bills", money(total_bills_period), ""],
+                numeric=[3],
+            ),
+            PdfTable(
+                "Payments Made",
+                ["#", "Date", "Note", "Source", "Amount", "By"],
+                [[str(i), p.date.strftime("%d/%m/%Y"), p.note or "—", p.source,
+                  money(p.amount), _username(p)] for i, p in enumerate(payments, 1)],
+                total=["", "", "", "Total Payments", money(total_paid_period), ""],
+                numeric=[4],
+            ),
+        ],
+    )
+
+
+def staff_statement_pdf(staff, start_date, end_date, payments, total_paid, salary,
+                        base_salary, has_override, remaining, **_) -> PdfDocument:
+    doc = PdfDocument(
+        f"Salary Statement — {staff.name}",
+        meta=[f"Month: {start_date.strftime('%B %Y')}", _period(start_date, end_date)],
+    )
+    if staff.designation:
+        doc.meta.insert(0, staff.designation)
+    doc.summary.append(
+        ("Monthly Salary (Adjusted)" if has_override else "Monthly Salary", money(salary))
+    )
+    if has_override:
+        doc.summary.append(("Base Salary", money(base_salary)))
+    doc.summary += [("Total Paid", money(total_paid)), ("Remaining", money(remaining))]
+    doc.tables.append(PdfTable(
+        "Payments",
+        ["Date", "Source", "Amount", "Note", "By"],
+        [[p.date.strftime("%d/%m/%Y"), "Bank" if p.source == "bank" else "Cash",
+          money(p.amount), p.note or "", _username(p)] for p in payments],
+        numeric=[2],
+    ))
+    return doc
+
+
+def staff_statement_all_pdf(start_date, end_date, rows, total_paid_all,
+                            total_salary_all, **_) -> PdfDocument:
+    return PdfDocument(
+        "Staff Salary Statement",
+        meta=[f"Month: {start_date.strftime('%B %Y')}", _period(start_date, end_date)],
+        summary=[
+            ("Total Salary", money(total_salary_all)),
+            ("Total Paid", money(total_paid_all)),
+            ("Total Remaining", money(total_salary_all - total_paid_all)),
+        ],
+        tables=[PdfTable(
+            "Staff",
+            ["Name", "Designation", "Salary", "Paid", "Balance"],
+            [[r["staff"].name, r["staff"].designation or "",
+              money(r["salary"]) + (" *" if r["has_override"] else ""),
+              money(r["paid"]), money(r["balance"])] for r in rows],
+            total=["Total", "", money(total_salary_all), money(total_paid_all),
+                   money(total_salary_all - total_paid_all)],
+            numeric=[2, 3, 4],
+        )],
+    )
+
+
+# ============================================================
+#  Report Cache – keyed on table write versions
+# ============================================================
+# Printable reports are cached under endpoint + form fields + the
+# TableVersion counters of the tables and months they read. A committed
+# write bumps the counter of its table and month in the same
+# transaction, so the next request computes a new key; reports over
+# months nobody touched keep being served from the cache.
+
+REPORT_CACHE_ENTRIES = int(os.getenv("REPORT_CACHE_ENTRIES", "64"))  # in-process LRU, 0 = off
+REPORT_CACHE_DIR = os.getenv("REPORT_CACHE_DIR", "")                 # optional, shared by workers
+REPORT_CACHE_MAX_FILES = 500
+REPORT_CACHE_MAX_BYTES = 8 * 1024 * 1024   # bigger pages are sent but not cached
+
+# Written only alongside (or derived from) a versioned table
+UNVERSIONED_TABLES = {
+    "table_versions", "schema_version", "delete_logs",
+    "ledger_totals", "daily_rollups", "daily_expense_rollups",
+}
+
+
+def _attr_values(obj, attr) -> list:
+    """Old and new value of a loaded attribute (one of them if unchanged)."""
+    history = inspect(obj).attrs[attr].history
+    return [*history.deleted, *history.unchanged, *history.added]
+
+
+def _row_periods(obj) -> set:
+    """Months ("YYYY-MM") a row sits in before and after this flush; {""} if undated."""
+    if isinstance(obj, StaffMonthlySalary):
+        periods = {
+            f"{year}-{month:02d}"
+            for year in _attr_values(obj, "year") if year
+            for month in _attr_values(obj, "month") if month
+        }
+    elif "date" in inspect(obj).mapper.columns:
+        periods = {d.strftime("%Y-%m") for d in _attr_values(obj, "date") if d}
+    else:
+        periods = set()
+    return periods or {""}
+
+
+def bump_table_versions(connection, keys) -> None:
+    """Add 1 to each (table, period) counter, creating missing ones (no commit)."""
+    if not keys:
+        return
+    table = TableVersion.__table__
+    # Fixed order so concurrent writers lock the rows the same way round
+    stmt = _upsert_insert(table).values([
+        {"table_name": name, "period": period, "version": 1}
+        for name, period in sorted(keys)
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["table_name", "period"],
+        set_={"version": table.c.version + 1},
+    )
+    connection.execute(stmt)
+
+
+def _pending_versions(session) -> set:
+    """Table-wide bumps owed by bulk statements in the current transaction."""
+    return session.info.setdefault("pending_table_versions", set())
+
+
+@event.listens_for(db.session, "before_flush")
+def track_table_versions(session, flush_context, instances):
+    """Note the table/month counters this flush owes a bump (paid on commit)."""
+    keys = _pending_versions(session)
+    for obj in (*session.new, *session.deleted, *session.dirty):
+        table = inspect(obj).mapper.local_table.name
+        if table in UNVERSIONED_TABLES:
+            continue
+        if obj in session.dirty and not session.is_modified(obj):
+            continue
+        keys.update((table, period) for period in _row_periods(obj))
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def _track_bulk_writes(orm_execute_state):
+    """
+    Bulk INSERT/UPDATE/DELETE bypass the flush: owe a bump of the whole
+    table, unless the caller tagged the statement with versions_tracked
+    after recording the exact months itself.
+    """
+    state = orm_execute_state
+    if not (state.is_insert or state.is_update or state.is_delete):
+        return
+    if state.execution_options.get("versions_tracked"):
+        return
+    table = getattr(state.statement.table, "name", None)
+    if table and table not in UNVERSIONED_TABLES:
+        _pending_versions(state.session).add((table, ""))
+
+
+@event.listens_for(db.session, "before_commit")
+def _bump_pending_versions(session):
+    # commit() flushes only after this hook; flush first so its rows are
+    # counted, then bump every owed counter once for the transaction
+    session.flush()
+    keys = session.info.pop("pending_table_versions", None)
+    if keys:
+        bump_table_versions(session.connection(), keys)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _drop_pending_versions(session):
+    session.info.pop("pending_table_versions", None)
+
+
+def data_versions(depends) -> dict:
+    """
+    {table: summed counter} for depends = [(model, first, last), ...]:
+    the months from date `first` to date `last` (None = open-ended) plus
+    the table-wide counter. Counters only grow, so the sum changes
+    whenever any of them does.
+    """
+    clauses = []
+    for model, first, last in depends:
+        months = []
+        if first:
+            months.append(TableVersion.period >= first.strftime("%Y-%m"))
+        if last:
+            months.append(TableVersion.period <= last.strftime("%Y-%m"))
+        clauses.append(db.and_(
+            TableVersion.table_name == model.__tablename__,
+            db.or_(TableVersion.period == "", db.and_(db.true(), *months)),
+        ))
+    return dict(
+        db.session.query(TableVersion.table_name, db.func.sum(TableVersion.version))
+        .filter(db.or_(*clauses))
+        .group_by(TableVersion.table_name)
+        .all()
+    )
+
+
+class ReportCache:
+    """
+    Rendered responses as (headers, body): an LRU in this process,
+    backed by files in `directory` when set so workers share entries.
+    """
+
+    def __init__(self, entries: int, directory: str = ""):
+        self.entries = entries
+        self.directory = directory
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.entries > 0 or bool(self.directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key + ".cache")
+
+    def _remember(self, key: str, value: tuple):
+        if self.entries <= 0:
+            return
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.entries:
+                self._lru.popitem(last=False)
+
+    def get(self, key: str):
+        with self._lock:
+            value = self._lru.get(key)
+            if value is not None:
+                self._lru.move_to_end(key)
+                return value
+        if not self.directory:
+            return None
+        try:
+            with open(self._path(key), "rb") as fh:
+                head, _, body = fh.read().partition(b"\n")
+        except OSError:
+            return None
+        value = (json.loads(head), body)
+        self._remember(key, value)
+        return value
+
+    def put(self, key: str, headers: dict, body: bytes):
+        self._remember(key, (headers, body))
+        if not self.directory:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as fh:
+                fh.write(json.dumps(headers).encode("utf-8") + b"\n" + body)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        _prune_cache_dir(self.directory, ".cache", REPORT_CACHE_MAX_FILES)
+
+    def clear(self):
+        with self._lock:
+            self._lru.clear()
+
+
+report_cache = ReportCache(REPORT_CACHE_ENTRIES, REPORT_CACHE_DIR)
+
+
+class GeneratedAt:
+    """
+    `timestamp` for cached pages: strftime() leaves a marker that
+    stamp_generated_at() fills in as the page is sent, so a cache hit
+    shows when it was served, not when it was first rendered.
+    """
+
+    def strftime(self, fmt: str) -> str:
+        return f"\x1e{fmt}\x1e"
+
+
+_GENERATED_AT = re.compile(rb"\x1e([^\x1e<>]*)\x1e")
+
+
+def stamp_generated_at(data) -> bytes:
+    """Replace the GeneratedAt markers in an HTML body (or chunk) with the current time."""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    now = datetime.now()
+    return _GENERATED_AT.sub(
+        lambda m: now.strftime(m.group(1).decode("utf-8")).encode("utf-8"), data
+    )
+
+
+def _is_html(headers) -> bool:
+    return (headers.get("Content-Type") or "").startswith("text/html")
+
+
+def cached_response(depends) -> tuple:
+    """
+    Look the current POST up in the report cache; `depends` as for
+    data_versions(). Returns (key, response) – response is None on a
+    miss, and the freshly built one should go through cache_response(key, ...).
+    """
+    if not report_cache.enabled:
+        return None, None
+    material = json.dumps([
+        request.endpoint,
+        sorted(request.form.items(multi=True)),
+        sorted(data_versions(depends).items()),
+    ])
+    key = hashlib.sha256(material.encode("utf-8")).hexdigest()
+    hit = report_cache.get(key)
+    if hit is None:
+        return key, None
+    headers, body = hit
+    if _is_html(headers):
+        body = stamp_generated_at(body)
+    response = app.response_class(body, headers=headers)
+    response.headers["X-Report-Cache"] = "hit"
+    return key, response
+
+
+def cache_response(key, response):
+    """
+    Store `response` under `key` (streamed bodies once fully sent) and
+    return it. HTML is cached with its GeneratedAt markers and sent stamped.
+    """
+    if response.status_code != 200:
+        return response
+    html = _is_html(response.headers)
+    if key is None:
+        if html and not response.is_streamed:
+            response.set_data(stamp_generated_at(response.get_data()))
+        elif html:
+            response.response = (stamp_generated_at(chunk) for chunk in response.response)
+        return response
+    headers = {name: value for name, value in response.headers.items()
+               if name in ("Content-Type", "Content-Disposition")}
+    response.headers["X-Report-Cache"] = "miss"
+
+    if not response.is_streamed:
+        body = response.get_data()
+        if len(body) <= REPORT_CACHE_MAX_BYTES:
+            report_cache.put(key, headers, body)
+        if html:
+            response.set_data(stamp_generated_at(body))
+        return response
+
+    def tee(chunks):
+        kept, size = [], 0
+        for chunk in chunks:
+            yield stamp_generated_at(chunk) if html else chunk
+            if kept is not None:
+                data = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+                size += len(data)
+                if size > REPORT_CACHE_MAX_BYTES:
+                    kept = None
+                else:
+                    kept.append(data)
+        if kept is not None:
+            report_cache.put(key, headers, b"".join(kept))
+
+    # send_file bodies must go through tee() too, not straight to the server
+    response.direct_passthrough = False
+    response.response = tee(response.response)
+    return response
+
+
 # ============================================================
 #  Reports – HTML version, opens in new tab
 # ============================================================
@@ -984,175 +2980,32 @@ def report():
             flash("End date cannot be earlier than start date.")
             return redirect(url_for("report"))
 
-        # --- What to include? ---
         report_type = request.form.get("report_type", "all")
-        include_collection = report_type in ("all", "collection")
-        include_expenses = report_type in ("all", "expenses")
-        include_doctor_bills = report_type in ("all", "doctor_bills")
-
         expense_category = (request.form.get("expense_category") or "").strip()
 
-        # --------------------------------------------------
-        # COLLECTION (DaySummary + LabCollection)
-        # --------------------------------------------------
-        if include_collection:
-            # Day-wise normal collection
-            days = DaySummary.query.filter(
-                DaySummary.date >= start_date,
-                DaySummary.date <= end_date
-            ).order_by(DaySummary.date).all()
-
-            total_normal_collection = sum(d.total_collection or 0 for d in days)
-
-            # Lab collections in the same range
-            lab_rows = LabCollection.query.filter(
-                LabCollection.date >= start_date,
-                LabCollection.date <= end_date
-            ).all()
-            total_lab = sum(r.amount or 0 for r in lab_rows)
-
-            # Map date -> lab row for template
-            lab_by_date = {r.date: r for r in lab_rows}
-
-            # Overall total collection (normal + lab)
-            total_collection = total_normal_collection + total_lab
-        else:
-            days = []
-            total_collection = 0
-            total_lab = 0
-            lab_by_date = {}
-
-        # --------------------------------------------------
-        # EXPENSES
-        # --------------------------------------------------
-        if include_expenses:
-            expenses_query = Expense.query.filter(
-                Expense.date >= start_date,
-                Expense.date <= end_date
-            )
-            if expense_category:
-                expenses_query = expenses_query.filter(
-                    Expense.category == expense_category
-                )
-            expenses_list = expenses_query.order_by(Expense.date).all()
-
-            total_expenses_query = db.session.query(
-                db.func.sum(Expense.amount)
-            ).filter(
-                Expense.date >= start_date,
-                Expense.date <= end_date
-            )
-            if expense_category:
-                total_expenses_query = total_expenses_query.filter(
-                    Expense.category == expense_category
-                )
-            total_expenses = total_expenses_query.scalar() or 0
-
-            expense_breakdown_query = db.session.query(
-                Expense.category,
-                db.func.sum(Expense.amount).label("total")
-            ).filter(
-                Expense.date >= start_date,
-                Expense.date <= end_date
-            )
-            if expense_category:
-                expense_breakdown_query = expense_breakdown_query.filter(
-                    Expense.category == expense_category
-                )
-            expense_breakdown = expense_breakdown_query.group_by(
-                Expense.category
-            ).order_by(
-                Expense.category
-            ).all()
-        else:
-            expenses_list = []
-            total_expenses = 0
-            expense_breakdown = []
-
-        # --------------------------------------------------
-        # DOCTOR BILLS
-        # --------------------------------------------------
-        if include_doctor_bills:
-            doctor_bills_list = DoctorBill.query.filter(
-                DoctorBill.date >= start_date,
-                DoctorBill.date <= end_date
-            ).order_by(DoctorBill.date).all()
-
-            total_doctor_bills = db.session.query(
-                db.func.sum(DoctorBill.amount)
-            ).filter(
-                DoctorBill.date >= start_date,
-                DoctorBill.date <= end_date
-            ).scalar() or 0
-
-            doctor_breakdown = db.session.query(
-                DoctorBill.doctor_name,
-                DoctorBill.modality,
-                db.func.sum(DoctorBill.amount).label("total")
-            ).filter(
-                DoctorBill.date >= start_date,
-                DoctorBill.date <= end_date
-            ).group_by(
-                DoctorBill.doctor_name,
-                DoctorBill.modality
-            ).order_by(
-                DoctorBill.doctor_name,
-                DoctorBill.modality
-            ).all()
-        else:
-            doctor_bills_list = []
-            total_doctor_bills = 0
-            doctor_breakdown = []
-
-        # --------------------------------------------------
-        # NET CASH (only when everything is included & no category filter)
-        # --------------------------------------------------
-        if (
-            include_collection
-            and include_expenses
-            and include_doctor_bills
-            and not expense_category
-        ):
-            net_cash = (
-                (total_collection or 0)
-                - (total_expenses or 0)
-                - (total_doctor_bills or 0)
-            )
-        else:
-            net_cash = None
-
-        # --------------------------------------------------
-        # Render printable HTML report
-        # --------------------------------------------------
-        return render_template(
-            "finance_report_pdf.html",
-            start_date=start_date,
-            end_date=end_date,
-            timestamp=datetime.now(),
-
-            report_type=report_type,
-            include_collection=include_collection,
-            include_expenses=include_expenses,
-            include_doctor_bills=include_doctor_bills,
-
-            expense_category=expense_category,
+        key, cached = cached_response([
+            (model, start_date, end_date)
+            for model in (DaySummary, LabCollection, Expense, DoctorBill)
+        ] + [(DailyRollup, None, None), (User, None, None)])
+        if cached:
+            return cached
 
-            days=days,
-            expenses_list=expenses_list,
-            doctor_bills_list=doctor_bills_list,
-
-            total_collection=total_collection,
-            total_expenses=total_expenses,
-            total_doctor_bills=total_doctor_bills,
-            net_cash=net_cash,
+        rep = build_finance_report(
+            start_date, end_date, report_type, expense_category, stream=True
+        )
 
-            expense_breakdown=expense_breakdown,
-            doctor_breakdown=doctor_breakdown,
+        if wants_pdf():
+            return cache_response(key, send_pdf(
+                finance_report_pdf(rep),
+                f"finance-report-{start_date}-to-{end_date}.pdf",
+            ))
 
-            # Lab-related data
-            total_lab=total_lab,
-            lab_by_date=lab_by_date,
-        )
+        # Printable HTML report, streamed while the rows are read
+        return cache_response(key, stream_page(
+            "finance_report_pdf.html",
+            report=rep,
+            timestamp=GeneratedAt(),
+        ))
 
     # ----------------- GET: show form -----------------
     expense_categories = (
@@ -1164,8 +3017,234 @@ def report():
     )
     category_list = [c[0] for c in expense_categories]
 
-    return render_template("report.html", expense_categories=category_list)
+    return render_template(
+        "report.html",
+        expense_categories=category_list,
+        export_datasets=[(name, spec.title) for name, spec in EXPORTS.items()],
+    )
+
+
+# ============================================================
+#  Data Export – CSV / XLSX, streamed
+# ============================================================
+# Rows come off a server-side cursor (yield_per) and go out in
+# STREAM_CHUNK pieces, so a multi-year export never sits in memory.
+
+def _who(row) -> str:
+    return row.created_by.username if row.created_by else ""
+
+
+@dataclass
+class ExportSpec:
+    title: str
+    model: type
+    columns: list                                  # (heading, row -> value)
+    joins: tuple = ()                              # many-to-one relationships to eager-load
+
+    def query(self, start_date, end_date):
+        model = self.model
+        return list_query(model).options(
+            *[db.joinedload(getattr(model, name)) for name in self.joins]
+        ).filter(
+            model.date >= start_date,
+            model.date <= end_date,
+        ).order_by(model.date, model.id).yield_per(STREAM_BATCH)
+
+
+EXPORTS = {
+    "expenses": ExportSpec("Expenses", Expense, [
+        ("Date", lambda r: r.date),
+        ("Category", lambda r: r.category),
+        ("Description", lambda r: r.description),
+        ("Amount", lambda r: r.amount),
+        ("Added by", _who),
+    ]),
+    "bank": ExportSpec("Bank ledger", BalanceEntry, [
+        ("Date", lambda r: r.date),
+        ("Description", lambda r: r.description),
+        ("Credit", lambda r: r.credit or 0),
+        ("Debit", lambda r: r.debit or 0),
+        ("Balance", lambda r: r.balance_after or 0),
+        ("Added by", _who),
+    ]),
+    "staff_payments": ExportSpec("Staff payments", StaffPayment, [
+        ("Date", lambda r: r.date),
+        ("Staff", lambda r: r.staff.name),
+        ("Designation", lambda r: r.staff.designation),
+        ("Amount", lambda r: r.amount),
+        ("Source", lambda r: r.source),
+        ("Note", lambda r: r.note),
+        ("Added by", _who),
+    ], joins=("staff",)),
+    "supplier_payments": ExportSpec("Supplier payments", SupplierPayment, [
+        ("Date", lambda r: r.date),
+        ("Supplier", lambda r: r.supplier.name),
+        ("Amount", lambda r: r.amount),
+        ("Source", lambda r: r.source),
+        ("Note", lambda r: r.note),
+        ("Added by", _who),
+    ], joins=("supplier",)),
+    "doctor_bills": ExportSpec("Doctor bills", DoctorBill, [
+        ("Date", lambda r: r.date),
+        ("Doctor", lambda r: r.doctor_name),
+        ("Modality", lambda r: r.modality),
+        ("Amount", lambda r: r.amount),
+        ("Added by", _who),
+    ]),
+}
+
+
+def csv_chunks(headings: list, rows):
+    """CSV text in ~STREAM_CHUNK pieces; starts with a BOM so Excel reads UTF-8."""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    buf.write("\ufeff")
+    writer.writerow(headings)
+    for row in rows:
+        writer.writerow(row)
+        if buf.tell() >= STREAM_CHUNK:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+class _ZipSink:
+    """Write-only file for ZipFile whose bytes are handed out as they come."""
+
+    def __init__(self):
+        self._parts = []
+        self.size = 0
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts, self.size = [], 0
+        return data
+
+
+XLSX_PARTS = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" Type="http://schemas.openxmlformats.org'
+        '/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>'
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" Type="http://schemas.openxmlformats.org'
+        '/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="{sheet}" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+}
+
+
+def _xlsx_row(values) -> str:
+    cells = []
+    for value in values:
+        if value is None:
+            cells.append("<c/>")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value!r}</v></c>")
+        else:
+            text_value = value.isoformat() if isinstance(value, date) else str(value)
+            cells.append(f'<c t="inlineStr"><is><t>{escape(text_value)}</t></is></c>')
+    return "<row>" + "".join(cells) + "</row>"
+
 
+def xlsx_chunks(sheet: str, headings: list, rows):
+    """
+    A one-sheet .xlsx written row by row: the worksheet XML is deflated
+    straight into the zip stream (inline strings, no shared-strings
+    table), so memory does not grow with the number of rows.
+    """
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, content in XLSX_PARTS.items():
+            zf.writestr(name, content.replace("{sheet}", escape(sheet)))
+        yield sink.drain()
+
+        with zf.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as part:
+            part.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                b'<sheetData>'
+            )
+            part.write(_xlsx_row(headings).encode("utf-8"))
+            for row in rows:
+                part.write(_xlsx_row(row).encode("utf-8"))
+                if sink.size >= STREAM_CHUNK:
+                    yield sink.drain()
+            part.write(b"</sheetData></worksheet>")
+    yield sink.drain()
+
+
+@app.route("/export", methods=["POST"])
+@login_required
+def export_data():
+    """Download one table over a date range as CSV or XLSX."""
+    spec = EXPORTS.get(request.form.get("dataset"))
+    fmt = request.form.get("format", "csv")
+    if spec is None or fmt not in ("csv", "xlsx"):
+        flash("Choose what to export and a file format.")
+        return redirect(url_for("report"))
+
+    try:
+        start_date = datetime.strptime(request.form.get("start_date"), "%Y-%m-%d").date()
+        end_date = datetime.strptime(request.form.get("end_date"), "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        flash("Invalid dates. Please select both start and end date.")
+        return redirect(url_for("report"))
+
+    if end_date < start_date:
+        flash("End date cannot be earlier than start date.")
+        return redirect(url_for("report"))
+
+    headings = [heading for heading, _ in spec.columns]
+    rows = (
+        [value(r) for _, value in spec.columns]
+        for r in spec.query(start_date, end_date)
+    )
+    if fmt == "xlsx":
+        body = xlsx_chunks(spec.title, headings, rows)
+        mimetype = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    else:
+        body = csv_chunks(headings, rows)
+        mimetype = "text/csv; charset=utf-8"
+
+    filename = f"{request.form['dataset']}-{start_date}-to-{end_date}.{fmt}"
+    return app.response_class(
+        stream_with_context(body),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
 
 
 # ============================================================
@@ -1205,20 +3284,13 @@ def bank():
         else:
             tx_date = datetime.today().date()
 
-        bank_credits = db.session.query(
-            db.func.sum(BalanceEntry.credit)
-        ).scalar() or 0
-        bank_debits = db.session.query(
-            db.func.sum(BalanceEntry.debit)
-        ).scalar() or 0
-        current_balance = bank_credits - bank_debits
-
         if tx_type == "deposit":
             credit = amount
             debit = 0
             desc = description or "Deposit from cash"
         elif tx_type == "withdraw":
-            if amount > current_balance:
+            if amount > lock_bank_balance():
+                db.session.rollback()
                 flash("Cannot withdraw more than current bank balance.")
                 return redirect(url_for("bank"))
             credit = 0
@@ -1236,46 +3308,28 @@ def bank():
             created_by_id=g.user.id,
         )
         db.session.add(entry)
-        db.session.commit()
+        db.session.flush()
 
-        recalc_bank_balances()
+        rebalance_bank_from(entry.date, entry.id)
+        db.session.commit()
         flash("Bank transaction recorded.")
         return redirect(url_for("bank"))
 
-    bank_credits = db.session.query(
-        db.func.sum(BalanceEntry.credit)
-    ).scalar() or 0
-    bank_debits = db.session.query(
-        db.func.sum(BalanceEntry.debit)
-    ).scalar() or 0
-    bank_balance = bank_credits - bank_debits
-
-    total_collection_all_normal = db.session.query(
-        db.func.sum(DaySummary.total_collection)
-    ).scalar() or 0
-    total_lab_all = db.session.query(
-        db.func.sum(LabCollection.amount)
-    ).scalar() or 0
-    total_collection_all = total_collection_all_normal + total_lab_all
-
-    total_expenses_all = db.session.query(
-        db.func.sum(Expense.amount)
-    ).scalar() or 0
-    total_doctor_bills_all = db.session.query(
-        db.func.sum(DoctorBill.amount)
-    ).scalar() or 0
-    total_wealth = total_collection_all - total_expenses_all - total_doctor_bills_all
-    cash_in_hand = total_wealth - bank_balance
+    totals = get_ledger_totals()
+    bank_balance = totals.bank_balance
+    cash_in_hand = totals.cash_in_hand
 
-    entries = BalanceEntry.query.order_by(
-        BalanceEntry.date.desc(), BalanceEntry.id.desc()
-    ).all()
+    entries, next_cursor = keyset_page(
+        list_query(BalanceEntry), BalanceEntry.date, BalanceEntry.id,
+        cursor=request.args.get("before"),
+    )
 
     return render_template(
         "bank.html",
         bank_balance=bank_balance,
         cash_in_hand=cash_in_hand,
         entries=entries,
+        next_cursor=next_cursor,
     )
 
 
@@ -1290,9 +3344,10 @@ def delete_bank_entry(entry_id):
         f"Deleted bank entry '{entry.description}' credit={entry.credit} debit={entry.debit}",
     )
 
+    entry_date, entry_id = entry.date, entry.id
     db.session.delete(entry)
+    rebalance_bank_from(entry_date, entry_id)
     db.session.commit()
-    recalc_bank_balances()
     flash("Bank transaction deleted.")
     return redirect(url_for("bank"))
 
@@ -1315,54 +3370,57 @@ def bank_statement():
         flash("End date cannot be earlier than start date.")
         return redirect(url_for("bank"))
 
-    opening_credits = db.session.query(
-        db.func.sum(BalanceEntry.credit)
-    ).filter(
-        BalanceEntry.date < start_date
-    ).scalar() or 0
+    # Opening balance and balance_after depend on every earlier month too
+    key, cached = cached_response([
+        (BalanceEntry, None, end_date), (DailyRollup, None, None), (User, None, None),
+    ])
+    if cached:
+        return cached
 
-    opening_debits = db.session.query(
-        db.func.sum(BalanceEntry.debit)
+    opening_credits, opening_debits = db.session.query(
+        db.func.sum(DailyRollup.bank_credits),
+        db.func.sum(DailyRollup.bank_debits),
     ).filter(
-        BalanceEntry.date < start_date
-    ).scalar() or 0
+        DailyRollup.date < start_date
+    ).one()
 
-    opening_balance = opening_credits - opening_debits
+    opening_balance = (opening_credits or 0) - (opening_debits or 0)
 
-    entries = BalanceEntry.query.filter(
+    entries = RowStream(list_query(BalanceEntry).filter(
         BalanceEntry.date >= start_date,
         BalanceEntry.date <= end_date
     ).order_by(
         BalanceEntry.date, BalanceEntry.id
-    ).all()
-
-    period_credits = db.session.query(
-        db.func.sum(BalanceEntry.credit)
-    ).filter(
-        BalanceEntry.date >= start_date,
-        BalanceEntry.date <= end_date
-    ).scalar() or 0
+    ))
 
-    period_debits = db.session.query(
-        db.func.sum(BalanceEntry.debit)
+    period_credits, period_debits = db.session.query(
+        db.func.sum(DailyRollup.bank_credits),
+        db.func.sum(DailyRollup.bank_debits),
     ).filter(
-        BalanceEntry.date >= start_date,
-        BalanceEntry.date <= end_date
-    ).scalar() or 0
+        DailyRollup.date >= start_date,
+        DailyRollup.date <= end_date
+    ).one()
+    period_credits = period_credits or 0
+    period_debits = period_debits or 0
 
     closing_balance = opening_balance + period_credits - period_debits
 
-    return render_template(
-        "bank_statement.html",
+    context = dict(
         start_date=start_date,
         end_date=end_date,
-        timestamp=datetime.now(),
+        timestamp=GeneratedAt(),
         opening_balance=opening_balance,
         closing_balance=closing_balance,
         period_credits=period_credits,
         period_debits=period_debits,
         entries=entries,
     )
+    if wants_pdf():
+        return cache_response(key, send_pdf(
+            bank_statement_pdf(**context),
+            f"bank-statement-{start_date}-to-{end_date}.pdf",
+        ))
+    return cache_response(key, stream_page("bank_statement.html", **context))
 
 
 # ============================================================
@@ -1501,15 +3559,8 @@ def staffs():
 
         bank_entry = None
         if source == "bank":
-            bank_credits = db.session.query(
-                db.func.sum(BalanceEntry.credit)
-            ).scalar() or 0
-            bank_debits = db.session.query(
-                db.func.sum(BalanceEntry.debit)
-            ).scalar() or 0
-            current_bank_balance = bank_credits - bank_debits
-
-            if amount > current_bank_balance:
+            if amount > lock_bank_balance():
+                db.session.rollback()
                 flash("Not enough balance in bank to pay this amount.")
                 return redirect(url_for("staffs"))
 
@@ -1550,10 +3601,10 @@ def staffs():
             created_by_id=g.user.id,
         )
         db.session.add(payment)
-        db.session.commit()
 
         if bank_entry:
-            recalc_bank_balances()
+            rebalance_bank_from(bank_entry.date, bank_entry.id)
+        db.session.commit()
 
         flash("Salary payment recorded.")
         return redirect(url_for("staffs"))
@@ -1565,27 +3616,19 @@ def staffs():
     # Get month/year for salary lookup
     filter_year = filter_start.year
     filter_month_num = filter_start.month
-    
+
+    # Effective salary + month payments for every staff in two queries
+    salaries = get_staff_salaries_for_month(
+        [s.id for s in staffs_qs], filter_year, filter_month_num
+    )
+
     for s in staffs_qs:
-        # Get effective salary for this month (may be from a previous month's change)
-        effective_salary, salary_record = get_staff_salary_for_month(s, filter_year, filter_month_num)
-        
-        # Total paid in the selected month only
-        total_paid_month = s.payments.filter(
-            StaffPayment.date >= filter_start,
-            StaffPayment.date <= filter_end
-        ).with_entities(
-            db.func.sum(StaffPayment.amount)
-        ).scalar() or 0
+        info = salaries[s.id]
+        effective_salary = info["effective_salary"]
+        salary_record = info["salary_record"]
+        total_paid_month = info["total_paid"]
+        payments_this_month = info["payments"]
 
-        # All payments in the selected month (for display under each staff)
-        payments_this_month = s.payments.filter(
-            StaffPayment.date >= filter_start,
-            StaffPayment.date <= filter_end
-        ).order_by(
-            StaffPayment.date.desc(), StaffPayment.id.desc()
-        ).all()
-        
         last_date = payments_this_month[0].date if payments_this_month else None
 
         # Balance = effective monthly salary - paid this month
@@ -1705,7 +3748,7 @@ def set_monthly_salary(staff_id):
 @login_required
 def staff_history(staff_id):
     staff = Staff.query.get_or_404(staff_id)
-    payments = StaffPayment.query.filter_by(staff_id=staff.id).order_by(
+    payments = list_query(StaffPayment).filter_by(staff_id=staff.id).order_by(
         StaffPayment.date, StaffPayment.id
     ).all()
     total_paid = sum(p.amount or 0 for p in payments)
@@ -1751,20 +3794,16 @@ def update_staff_payment(payment_id):
             if note:
                 exp.description = note
 
-    touched_bank = False
     if payment.bank_entry_id:
         be = BalanceEntry.query.get(payment.bank_entry_id)
         if be:
             be.debit = new_amount
             if note:
                 be.description = f"Salary paid to {staff.name} from bank ({note})"
-            touched_bank = True
+            rebalance_bank_from(be.date, be.id)
 
     db.session.commit()
 
-    if touched_bank:
-        recalc_bank_balances()
-
     flash("Salary payment updated.")
     return redirect(url_for("staff_history", staff_id=payment.staff_id))
 
@@ -1784,13 +3823,13 @@ def delete_staff_payment(payment_id):
         f"Deleted salary payment to {staff.name} {payment.amount:.2f} BDT on {payment.date}",
     )
 
-    touched_bank = False
+    bank_dates = []
 
     if payment.bank_entry_id:
         be = BalanceEntry.query.get(payment.bank_entry_id)
         if be:
+            bank_dates.append(be.date)
             db.session.delete(be)
-            touched_bank = True
 
     if payment.expense_id:
         exp = Expense.query.get(payment.expense_id)
@@ -1798,11 +3837,10 @@ def delete_staff_payment(payment_id):
             db.session.delete(exp)
 
     db.session.delete(payment)
+    if bank_dates:
+        rebalance_bank_from(min(bank_dates))
     db.session.commit()
 
-    if touched_bank:
-        recalc_bank_balances()
-
     flash("Salary payment deleted.")
     return redirect(url_for("staff_history", staff_id=payment.staff_id))
 
@@ -1845,7 +3883,7 @@ def staff_salary_statement():
     start_date = start_dt.date()
     end_date = (next_month_dt - timedelta(days=1)).date()
 
-    payments = StaffPayment.query.filter(
+    payments = list_query(StaffPayment).filter(
         StaffPayment.staff_id == staff.id,
         StaffPayment.date >= start_date,
         StaffPayment.date <= end_date,
@@ -1860,8 +3898,7 @@ def staff_salary_statement():
     
     remaining = effective_salary - total_paid
 
-    return render_template(
-        "staff_salary_statement.html",
+    context = dict(
         staff=staff,
         year=year,
         month=month,
@@ -1875,6 +3912,12 @@ def staff_salary_statement():
         remaining=remaining,
         timestamp=datetime.now(),
     )
+    if wants_pdf():
+        return send_pdf(
+            staff_statement_pdf(**context),
+            f"salary-{staff.id}-{year}-{month:02d}.pdf",
+        )
+    return render_template("staff_salary_statement.html", **context)
 
 
 @app.route("/staffs/statement/all", methods=["POST"])
@@ -1904,22 +3947,28 @@ def staff_salary_statement_all():
     start_date = start_dt.date()
     end_date = (next_month_dt - timedelta(days=1)).date()
 
+    # The effective salary may come from any earlier salary change
+    key, cached = cached_response([
+        (Staff, None, None),
+        (StaffPayment, start_date, end_date),
+        (StaffMonthlySalary, None, end_date),
+    ])
+    if cached:
+        return cached
+
     staffs_qs = Staff.query.filter_by(active=True).order_by(Staff.id).all()
 
     rows = []
     total_paid_all = 0
     total_salary_all = 0
 
+    salaries = get_staff_salaries_for_month([s.id for s in staffs_qs], year, month)
+
     for s in staffs_qs:
-        # Get effective salary for this month
-        effective_salary, salary_record = get_staff_salary_for_month(s, year, month)
-        
-        payments = StaffPayment.query.filter(
-            StaffPayment.staff_id == s.id,
-            StaffPayment.date >= start_date,
-            StaffPayment.date <= end_date,
-        ).all()
-        paid = sum(p.amount or 0 for p in payments)
+        info = salaries[s.id]
+        effective_salary = info["effective_salary"]
+        salary_record = info["salary_record"]
+        paid = info["total_paid"]
         balance = effective_salary - paid
         total_paid_all += paid
         total_salary_all += effective_salary
@@ -1933,8 +3982,7 @@ def staff_salary_statement_all():
             }
         )
 
-    return render_template(
-        "staff_salary_statement_all.html",
+    context = dict(
         year=year,
         month=month,
         start_date=start_date,
@@ -1942,7 +3990,58 @@ def staff_salary_statement_all():
         rows=rows,
         total_paid_all=total_paid_all,
         total_salary_all=total_salary_all,
-        timestamp=datetime.now(),
+        timestamp=GeneratedAt(),
+    )
+    if wants_pdf():
+        return cache_response(key, send_pdf(
+            staff_statement_all_pdf(**context),
+            f"salary-all-{year}-{month:02d}.pdf",
+        ))
+    return cache_response(key, app.make_response(
+        render_template("staff_salary_statement_all.html", **context)
+    ))
+
+
+@app.route("/staffs/ledger")
+@login_required
+def staff_payroll_ledger():
+    """
+    Payroll ledger: effective salary, paid and carried-forward arrears for
+    every active staff and month of a range. ?start=YYYY-MM&end=YYYY-MM,
+    or ?year=YYYY; defaults to this year up to the current month.
+    """
+    today = datetime.today().date()
+    try:
+        if request.args.get("start"):
+            first = datetime.strptime(request.args["start"] + "-01", "%Y-%m-%d").date()
+            last = datetime.strptime(
+                (request.args.get("end") or request.args["start"]) + "-01", "%Y-%m-%d"
+            ).date()
+        elif request.args.get("year"):
+            year = int(request.args["year"])
+            first = date(year, 1, 1)
+            last = today.replace(day=1) if year == today.year else date(year, 12, 1)
+        else:
+            first, last = today.replace(month=1, day=1), today.replace(day=1)
+    except ValueError:
+        flash("Invalid month range.")
+        return redirect(url_for("staff_payroll_ledger"))
+
+    if last < first:
+        first, last = last, first
+    months = months_between(first, last)
+    if len(months) > PAYROLL_LEDGER_MAX_MONTHS:
+        flash(f"Showing the first {PAYROLL_LEDGER_MAX_MONTHS} months of the range.")
+        months = months[:PAYROLL_LEDGER_MAX_MONTHS]
+
+    staffs_qs = Staff.query.filter_by(active=True).order_by(Staff.id).all()
+    ledger = payroll_ledger(staffs_qs, months)
+
+    return render_template(
+        "staff_ledger.html",
+        ledger=ledger,
+        start_month=f"{months[0][0]:04d}-{months[0][1]:02d}",
+        end_month=f"{months[-1][0]:04d}-{months[-1][1]:02d}",
     )
 
 
@@ -2022,10 +4121,7 @@ def suppliers():
         else:
             pay_date = today
 
-        total_paid_so_far = supplier.payments.with_entities(
-            db.func.sum(SupplierPayment.amount)
-        ).scalar() or 0
-        remaining = (supplier.total_due or 0) - total_paid_so_far
+        remaining = supplier.balance
 
         if supplier.total_due and remaining >= 0 and amount > remaining:
             flash(f"Cannot pay more than remaining amount ({remaining:.2f} ৳).")
@@ -2033,15 +4129,8 @@ def suppliers():
 
         bank_entry = None
         if source == "bank":
-            bank_credits = db.session.query(
-                db.func.sum(BalanceEntry.credit)
-            ).scalar() or 0
-            bank_debits = db.session.query(
-                db.func.sum(BalanceEntry.debit)
-            ).scalar() or 0
-            current_bank_balance = bank_credits - bank_debits
-
-            if amount > current_bank_balance:
+            if amount > lock_bank_balance():
+                db.session.rollback()
                 flash("Not enough balance in bank to pay this amount.")
                 return redirect_back()
 
@@ -2082,39 +4171,75 @@ def suppliers():
             created_by_id=g.user.id,
         )
         db.session.add(payment)
-        db.session.commit()
 
         if bank_entry:
-            recalc_bank_balances()
+            rebalance_bank_from(bank_entry.date, bank_entry.id)
+        db.session.commit()
 
         flash("Supplier payment recorded.")
         return redirect_back()
 
     # ---------- GET: list suppliers ----------
-    suppliers_qs = Supplier.query.order_by(Supplier.id).all()
-    rows = []
-    for s in suppliers_qs:
-        total_paid = s.payments.with_entities(
-            db.func.sum(SupplierPayment.amount)
-        ).scalar() or 0
+    sort = request.args.get("sort", "id")
+    balance_filter = request.args.get("balance", "all")
+    rows = supplier_overview(sort=sort, balance_filter=balance_filter)
+
+    # Statement dropdown always lists every supplier
+    if balance_filter == "all":
+        statement_suppliers = [row["supplier"] for row in rows]
+    else:
+        statement_suppliers = Supplier.query.order_by(Supplier.id).all()
 
-        last_payment = s.payments.order_by(
-            SupplierPayment.date.desc(), SupplierPayment.id.desc()
-        ).first()
-        last_date = last_payment.date if last_payment else None
+    return render_template(
+        "suppliers.html",
+        rows=rows,
+        statement_suppliers=statement_suppliers,
+        sort=sort,
+        balance_filter=balance_filter,
+    )
 
-        balance = (s.total_due or 0) - total_paid
 
-        rows.append(
-            {
-                "supplier": s,
-                "total_paid": total_paid,
-                "balance": balance,
-                "last_date": last_date,
-            }
-        )
+def supplier_overview(sort: str = "id", balance_filter: str = "all") -> list:
+    """
+    Supplier list rows from one query: each supplier with total paid,
+    balance and last payment date. Totals are the stored Supplier columns;
+    the last date is a per-supplier lookup on ix_supplier_payments_supplier_date.
+    Sorting and the balance filter ("due" / "settled" / "all") are applied in SQL.
+    """
+    total_paid = db.func.coalesce(Supplier.total_paid, 0)
+    balance = db.func.coalesce(Supplier.total_due, 0) - total_paid
+    last_date = db.select(db.func.max(SupplierPayment.date)).where(
+        SupplierPayment.supplier_id == Supplier.id
+    ).correlate(Supplier).scalar_subquery()
+
+    query = db.session.query(
+        Supplier,
+        total_paid.label("total_paid"),
+        balance.label("balance"),
+        last_date.label("last_date"),
+    )
 
-    return render_template("suppliers.html", rows=rows)
+    if balance_filter == "due":
+        query = query.filter(balance > 0.005)
+    elif balance_filter == "settled":
+        query = query.filter(balance <= 0.005)
+
+    order_by = {
+        "name": (Supplier.name, Supplier.id),
+        "balance_desc": (balance.desc(), Supplier.id),
+        "balance_asc": (balance.asc(), Supplier.id),
+        "last_paid": (db.nulls_last(last_date.desc()), Supplier.id),
+    }.get(sort, (Supplier.id,))
+
+    return [
+        {
+            "supplier": supplier,
+            "total_paid": total_paid or 0,
+            "balance": balance or 0,
+            "last_date": last_date,
+        }
+        for supplier, total_paid, balance, last_date in query.order_by(*order_by)
+    ]
 
 
 @app.route("/suppliers/<int:supplier_id>/delete", methods=["POST"])
@@ -2125,34 +4250,12 @@ def delete_supplier(supplier_id):
     and linked expenses / bank entries.
     """
     supplier = Supplier.query.get_or_404(supplier_id)
+    name = supplier.name
 
-    log_delete("supplier", supplier.id, f"Deleted supplier '{supplier.name}' and all bills/payments")
-
-    touched_bank = False
-
-    # Delete all bills
-    SupplierBill.query.filter_by(supplier_id=supplier.id).delete()
-
-    # Delete all payments and linked entries
-    payments = SupplierPayment.query.filter_by(supplier_id=supplier.id).all()
-    for p in payments:
-        if p.bank_entry_id:
-            be = BalanceEntry.query.get(p.bank_entry_id)
-            if be:
-                db.session.delete(be)
-                touched_bank = True
-        if p.expense_id:
-            exp = Expense.query.get(p.expense_id)
-            if exp:
-                db.session.delete(exp)
-        db.session.delete(p)
-
-    db.session.delete(supplier)
+    summary = cascade_delete(supplier_ids=[supplier.id])
+    log_delete("supplier", supplier_id, f"Deleted supplier '{name}': {summary.describe()}")
     db.session.commit()
 
-    if touched_bank:
-        recalc_bank_balances()
-
     flash("Supplier and all related bills/payments deleted.")
     return redirect(url_for("suppliers"))
 
@@ -2204,9 +4307,6 @@ def supplier_detail(supplier_id):
                 created_by_id=g.user.id,
             )
             db.session.add(bill)
-
-            # Recalculate total_due
-            supplier.recalc_total_due()
             db.session.commit()
 
             flash(f"Bill of ৳{amount:.2f} added successfully.")
@@ -2230,27 +4330,131 @@ def supplier_detail(supplier_id):
             return redirect(url_for("supplier_detail", supplier_id=supplier_id))
 
     # Get all bills and payments
-    bills = SupplierBill.query.filter_by(supplier_id=supplier.id).order_by(
+    bills = list_query(SupplierBill).filter_by(supplier_id=supplier.id).order_by(
         SupplierBill.date.desc(), SupplierBill.id.desc()
     ).all()
 
-    payments = SupplierPayment.query.filter_by(supplier_id=supplier.id).order_by(
+    payments = list_query(SupplierPayment).filter_by(supplier_id=supplier.id).order_by(
         SupplierPayment.date.desc(), SupplierPayment.id.desc()
     ).all()
 
-    total_bills = sum(b.amount or 0 for b in bills)
-    total_paid = sum(p.amount or 0 for p in payments)
-    balance = total_bills - total_paid
-
     return render_template(
         "supplier_detail.html",
         supplier=supplier,
         bills=bills,
         payments=payments,
-        total_bills=total_bills,
-        total_paid=total_paid,
-        balance=balance,
+        total_bills=supplier.total_due or 0,
+        total_paid=supplier.total_paid or 0,
+        balance=supplier.balance,
+    )
+
+
+# ------------------------------------------------------------
+# Supplier statement engine: opening and period figures from one
+# SUM(CASE ...) query per table, all-time totals from the stored
+# Supplier columns, and the bills and payments of the period merged
+# into one ledger whose running balance is a window SUM.
+# ------------------------------------------------------------
+
+@dataclass
+class SupplierStatement:
+    """Figures for one supplier over start_date..end_date."""
+    supplier: object
+    start_date: date
+    end_date: date
+    opening_balance: float
+    bill_count: int
+    total_bills_period: float
+    payment_count: int
+    total_paid_period: float
+    total_bills_all: float
+    total_paid_all: float
+
+    @property
+    def closing_balance(self) -> float:
+        return self.opening_balance + self.total_bills_period - self.total_paid_period
+
+    @property
+    def balance_all(self) -> float:
+        return self.total_bills_all - self.total_paid_all
+
+    def context(self) -> dict:
+        """Template/PDF keyword arguments."""
+        return dict(vars(self), closing_balance=self.closing_balance, balance_all=self.balance_all)
+
+
+def _statement_sums(model, supplier_id: int, start_date, end_date) -> tuple:
+    """(before start, in period, rows in period) for one table."""
+    in_period = model.date >= start_date
+    return db.session.query(
+        db.func.coalesce(db.func.sum(db.case((model.date < start_date, model.amount), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((in_period, model.amount), else_=0)), 0),
+        db.func.count(db.case((in_period, model.id))),
+    ).filter(model.supplier_id == supplier_id, model.date <= end_date).one()
+
+
+def supplier_statement_for(supplier, start_date, end_date) -> SupplierStatement:
+    """Opening, period and closing figures in two queries; all-time from the supplier row."""
+    bills_before, bills_period, bill_count = _statement_sums(
+        SupplierBill, supplier.id, start_date, end_date
+    )
+    paid_before, paid_period, payment_count = _statement_sums(
+        SupplierPayment, supplier.id, start_date, end_date
+    )
+    return SupplierStatement(
+        supplier=supplier,
+        start_date=start_date,
+        end_date=end_date,
+        opening_balance=bills_before - paid_before,
+        bill_count=bill_count,
+        total_bills_period=bills_period,
+        payment_count=payment_count,
+        total_paid_period=paid_period,
+        total_bills_all=supplier.total_due or 0,
+        total_paid_all=supplier.total_paid or 0,
+    )
+
+
+def supplier_ledger_query(statement: SupplierStatement):
+    """
+    Bills and payments of the period in date order (bills first on a
+    day), each with the balance after it: opening balance plus a running
+    SUM(bill - payment) OVER (ORDER BY date, kind, id).
+    """
+    sid, start, end = statement.supplier.id, statement.start_date, statement.end_date
+    bills = db.select(
+        db.literal("bill", db.String).label("kind"),
+        SupplierBill.id.label("id"),
+        SupplierBill.date.label("date"),
+        SupplierBill.description.label("description"),
+        db.cast(db.null(), db.String).label("source"),
+        SupplierBill.amount.label("amount"),
+        SupplierBill.amount.label("delta"),
+        SupplierBill.created_by_id.label("created_by_id"),
+    ).where(SupplierBill.supplier_id == sid, SupplierBill.date >= start, SupplierBill.date <= end)
+    payments = db.select(
+        db.literal("payment", db.String),
+        SupplierPayment.id,
+        SupplierPayment.date,
+        SupplierPayment.note,
+        SupplierPayment.source,
+        SupplierPayment.amount,
+        -SupplierPayment.amount,
+        SupplierPayment.created_by_id,
+    ).where(SupplierPayment.supplier_id == sid, SupplierPayment.date >= start,
+            SupplierPayment.date <= end)
+    rows = db.union_all(bills, payments).subquery()
+
+    order = (rows.c.date, rows.c.kind, rows.c.id)
+    balance = db.literal(statement.opening_balance, db.Float) + db.func.sum(rows.c.delta).over(
+        order_by=order, rows=(None, 0)
     )
+    return db.session.query(
+        rows.c.kind, rows.c.id, rows.c.date, rows.c.description, rows.c.source,
+        rows.c.amount, balance.label("balance"), User.username.label("created_by"),
+    ).outerjoin(
+        User, User.id == rows.c.created_by_id
+    ).order_by(*order)
 
 
 @app.route("/suppliers/<int:supplier_id>/report", methods=["POST"])
@@ -2273,67 +4477,44 @@ def supplier_report(supplier_id):
         flash("End date cannot be earlier than start date.")
         return redirect(url_for("supplier_detail", supplier_id=supplier_id))
 
-    # Get bills in date range
-    bills = SupplierBill.query.filter(
-        SupplierBill.supplier_id == supplier.id,
-        SupplierBill.date >= start_date,
-        SupplierBill.date <= end_date,
-    ).order_by(SupplierBill.date, SupplierBill.id).all()
-
-    # Get payments in date range
-    payments = SupplierPayment.query.filter(
-        SupplierPayment.supplier_id == supplier.id,
-        SupplierPayment.date >= start_date,
-        SupplierPayment.date <= end_date,
-    ).order_by(SupplierPayment.date, SupplierPayment.id).all()
-
-    # Calculate totals for this period
-    total_bills_period = sum(b.amount or 0 for b in bills)
-    total_paid_period = sum(p.amount or 0 for p in payments)
-
-    # Calculate all-time totals
-    total_bills_all = supplier.bills.with_entities(
-        db.func.sum(SupplierBill.amount)
-    ).scalar() or 0
-    total_paid_all = supplier.payments.with_entities(
-        db.func.sum(SupplierPayment.amount)
-    ).scalar() or 0
-    balance_all = total_bills_all - total_paid_all
-
-    # Opening balance (before start date)
-    bills_before = supplier.bills.filter(
-        SupplierBill.date < start_date
-    ).with_entities(db.func.sum(SupplierBill.amount)).scalar() or 0
-
-    paid_before = supplier.payments.filter(
-        SupplierPayment.date < start_date
-    ).with_entities(db.func.sum(SupplierPayment.amount)).scalar() or 0
+    statement = supplier_statement_for(supplier, start_date, end_date)
 
-    opening_balance = bills_before - paid_before
-    closing_balance = opening_balance + total_bills_period - total_paid_period
+    # Rows are streamed into the page as it renders
+    bills = RowStream(
+        list_query(SupplierBill).filter(
+            SupplierBill.supplier_id == supplier.id,
+            SupplierBill.date >= start_date,
+            SupplierBill.date <= end_date,
+        ).order_by(SupplierBill.date, SupplierBill.id),
+        count=statement.bill_count,
+    )
+    payments = RowStream(
+        list_query(SupplierPayment).filter(
+            SupplierPayment.supplier_id == supplier.id,
+            SupplierPayment.date >= start_date,
+            SupplierPayment.date <= end_date,
+        ).order_by(SupplierPayment.date, SupplierPayment.id),
+        count=statement.payment_count,
+    )
 
-    return render_template(
-        "supplier_report.html",
-        supplier=supplier,
-        start_date=start_date,
-        end_date=end_date,
+    context = dict(
+        statement.context(),
         bills=bills,
         payments=payments,
-        total_bills_period=total_bills_period,
-        total_paid_period=total_paid_period,
-        opening_balance=opening_balance,
-        closing_balance=closing_balance,
-        total_bills_all=total_bills_all,
-        total_paid_all=total_paid_all,
-        balance_all=balance_all,
         timestamp=datetime.now(),
     )
+    if wants_pdf():
+        return send_pdf(
+            supplier_report_pdf(**context),
+            f"supplier-{supplier.id}-{start_date}-to-{end_date}.pdf",
+        )
+    return stream_page("supplier_report.html", **context)
 
 
 @app.route("/suppliers/<int:supplier_id>/bill/<int:bill_id>/delete", methods=["POST"])
 @admin_required
 def delete_supplier_bill(supplier_id, bill_id):
-    """Delete a supplier bill and recalculate total_due."""
+    """Delete a supplier bill (its amount comes off total_due on flush)."""
     bill = SupplierBill.query.get_or_404(bill_id)
     supplier = Supplier.query.get_or_404(supplier_id)
 
@@ -2348,7 +4529,6 @@ def delete_supplier_bill(supplier_id, bill_id):
     )
 
     db.session.delete(bill)
-    supplier.recalc_total_due()
     db.session.commit()
 
     flash("Bill deleted.")
@@ -2359,16 +4539,14 @@ def delete_supplier_bill(supplier_id, bill_id):
 @login_required
 def supplier_history(supplier_id):
     supplier = Supplier.query.get_or_404(supplier_id)
-    payments = SupplierPayment.query.filter_by(supplier_id=supplier.id).order_by(
+    payments = list_query(SupplierPayment).filter_by(supplier_id=supplier.id).order_by(
         SupplierPayment.date, SupplierPayment.id
     ).all()
-    total_paid = sum(p.amount or 0 for p in payments)
-
     return render_template(
         "supplier_history.html",
         supplier=supplier,
         payments=payments,
-        total_paid=total_paid,
+        total_paid=supplier.total_paid or 0,
     )
 
 
@@ -2405,20 +4583,16 @@ def update_supplier_payment(payment_id):
             if note:
                 exp.description = note
 
-    touched_bank = False
     if payment.bank_entry_id:
         be = BalanceEntry.query.get(payment.bank_entry_id)
         if be:
             be.debit = new_amount
             if note:
                 be.description = f"Payment to supplier {supplier.name} from bank ({note})"
-            touched_bank = True
+            rebalance_bank_from(be.date, be.id)
 
     db.session.commit()
 
-    if touched_bank:
-        recalc_bank_balances()
-
     flash("Supplier payment updated.")
     return redirect(url_for("supplier_history", supplier_id=payment.supplier_id))
 
@@ -2438,13 +4612,13 @@ def delete_supplier_payment(payment_id):
         f"Deleted supplier payment to {supplier.name} {payment.amount:.2f} BDT on {payment.date}",
     )
 
-    touched_bank = False
+    bank_dates = []
 
     if payment.bank_entry_id:
         be = BalanceEntry.query.get(payment.bank_entry_id)
         if be:
+            bank_dates.append(be.date)
             db.session.delete(be)
-            touched_bank = True
 
     if payment.expense_id:
         exp = Expense.query.get(payment.expense_id)
@@ -2452,11 +4626,10 @@ def delete_supplier_payment(payment_id):
             db.session.delete(exp)
 
     db.session.delete(payment)
+    if bank_dates:
+        rebalance_bank_from(min(bank_dates))
     db.session.commit()
 
-    if touched_bank:
-        recalc_bank_balances()
-
     flash("Supplier payment deleted.")
     return redirect(url_for("supplier_history", supplier_id=payment.supplier_id))
 
@@ -2492,27 +4665,16 @@ def supplier_statement():
         flash("End date cannot be earlier than start date.")
         return redirect(url_for("suppliers"))
 
-    payments = SupplierPayment.query.filter(
-        SupplierPayment.supplier_id == supplier.id,
-        SupplierPayment.date >= start_date,
-        SupplierPayment.date <= end_date,
-    ).order_by(SupplierPayment.date, SupplierPayment.id).all()
-
-    total_paid_range = sum(p.amount or 0 for p in payments)
-    total_paid_all = supplier.payments.with_entities(
-        db.func.sum(SupplierPayment.amount)
-    ).scalar() or 0
-    balance_total = (supplier.total_due or 0) - total_paid_all
+    statement = supplier_statement_for(supplier, start_date, end_date)
+    ledger = RowStream(
+        supplier_ledger_query(statement),
+        count=statement.bill_count + statement.payment_count,
+    )
 
-    return render_template(
+    return stream_page(
         "supplier_statement.html",
-        supplier=supplier,
-        start_date=start_date,
-        end_date=end_date,
-        payments=payments,
-        total_paid_range=total_paid_range,
-        total_paid_all=total_paid_all,
-        balance_total=balance_total,
+        **statement.context(),
+        ledger=ledger,
         timestamp=datetime.now(),
     )
 
@@ -2587,8 +4749,11 @@ def delete_expense_template(template_id):
 @app.route("/delete-history")
 @admin_required
 def delete_history():
-    logs = DeleteLog.query.order_by(DeleteLog.timestamp.desc()).limit(500).all()
-    return render_template("delete_history.html", logs=logs)
+    logs, next_cursor = keyset_page(
+        DeleteLog.query, DeleteLog.timestamp, DeleteLog.id,
+        cursor=request.args.get("before"),
+    )
+    return render_template("delete_history.html", logs=logs, next_cursor=next_cursor)
 
 
 # ============================================================
@@ -2626,6 +4791,18 @@ def logout():
 #  SuperAdmin Panel
 # ============================================================
 
+@app.route("/superadmin/sql-stats")
+@superadmin_required
+def sql_stats():
+    """Per-endpoint SQL timings for the recent requests of this worker."""
+    return render_template(
+        "sql_stats.html",
+        rows=sql_stats_by_endpoint(),
+        keep=SQL_STATS_KEEP,
+        repeat_limit=SQL_REPEAT_LIMIT,
+    )
+
+
 @app.route("/superadmin")
 @superadmin_required
 def superadmin_panel():
@@ -2633,6 +4810,50 @@ def superadmin_panel():
     return render_template("superadmin_panel.html")
 
 
+@app.route("/superadmin/verify-totals", methods=["POST"])
+@superadmin_required
+def verify_totals():
+    """Compare running totals and daily rollups with the ledger and rebuild on drift."""
+    mismatches = verify_ledger_totals(repair=True)
+    if mismatches:
+        for col, stored, live in mismatches:
+            flash(f"{col}: stored {stored or 0:.2f}, live {live:.2f} (rebuilt)")
+        flash(f"Running totals rebuilt ({len(mismatches)} value(s) had drifted).")
+    else:
+        flash("Running totals match the ledger.")
+
+    bad_dates = verify_daily_rollups(repair=True)
+    if bad_dates:
+        flash(f"Daily rollups rebuilt ({len(bad_dates)} date(s) had drifted, first {bad_dates[0]}).")
+    else:
+        flash("Daily rollups match the ledger.")
+    return redirect(url_for("superadmin_panel"))
+
+
+def load_expenses_with_links(expense_ids) -> tuple:
+    """
+    Batch-load expenses plus what edit_expense() must keep in step with
+    them, one IN query each:
+      - {expense_id: Expense}
+      - {expense_id: [StaffPayment / SupplierPayment that created it]}
+      - {bank_entry_id: BalanceEntry} for those payments' bank entries
+    """
+    if not expense_ids:
+        return {}, {}, {}
+    expenses = {e.id: e for e in Expense.query.filter(Expense.id.in_(expense_ids))}
+
+    payments = {}
+    for model in (StaffPayment, SupplierPayment):
+        for payment in model.query.filter(model.expense_id.in_(list(expenses))).order_by(model.id):
+            payments.setdefault(payment.expense_id, []).append(payment)
+
+    bank_ids = {p.bank_entry_id for linked in payments.values() for p in linked if p.bank_entry_id}
+    bank_entries = {}
+    if bank_ids:
+        bank_entries = {b.id: b for b in BalanceEntry.query.filter(BalanceEntry.id.in_(bank_ids))}
+    return expenses, payments, bank_entries
+
+
 @app.route("/superadmin/edit-expense", methods=["GET", "POST"])
 @superadmin_required
 def edit_expense():
@@ -2649,7 +4870,7 @@ def edit_expense():
             if date_str:
                 try:
                     selected_date = datetime.strptime(date_str, "%Y-%m-%d").date()
-                    expenses = Expense.query.filter_by(date=selected_date).order_by(Expense.id).all()
+                    expenses = list_query(Expense).filter_by(date=selected_date).order_by(Expense.id).all()
                 except ValueError:
                     flash("Invalid date format.")
             else:
@@ -2674,17 +4895,23 @@ def edit_expense():
             
             updated_count = 0
             deleted_count = 0
-            
-            for i, exp_id in enumerate(expense_ids):
+            bank_dates = []     # dates of bank entries whose debit changed
+
+            ids = []
+            for exp_id in expense_ids:
                 try:
-                    exp_id_int = int(exp_id)
+                    ids.append(int(exp_id))
                 except ValueError:
-                    continue
-                
-                expense = Expense.query.get(exp_id_int)
+                    ids.append(None)
+            expenses_by_id, payments_by_expense, bank_by_id = load_expenses_with_links(
+                [i for i in ids if i is not None]
+            )
+
+            for i, exp_id in enumerate(expense_ids):
+                expense = expenses_by_id.get(ids[i])
                 if not expense:
                     continue
-                
+
                 # Check if marked for deletion
                 if exp_id in delete_flags:
                     log_delete(
@@ -2695,21 +4922,20 @@ def edit_expense():
                     db.session.delete(expense)
                     deleted_count += 1
                     continue
-                
+
                 # Update expense
                 category = (categories[i] if i < len(categories) else "").strip()
                 description = (descriptions[i] if i < len(descriptions) else "").strip()
                 amount_str = amounts[i] if i < len(amounts) else "0"
-                
+
                 try:
                     amount = float(amount_str or 0)
                 except ValueError:
                     amount = expense.amount
-                
+
                 # Track if anything changed
                 changed = False
-                old_amount = expense.amount
-                
+
                 if category and category != expense.category:
                     expense.category = category
                     changed = True
@@ -2717,48 +4943,29 @@ def edit_expense():
                     expense.description = description
                     changed = True
                 if amount > 0 and amount != expense.amount:
-                    old_amt = expense.amount
                     expense.amount = amount
                     changed = True
-                    
-                    # Also update linked StaffPayment if exists
-                    linked_staff_payment = StaffPayment.query.filter_by(expense_id=expense.id).first()
-                    if linked_staff_payment:
-                        linked_staff_payment.amount = amount
-                        flash(f"DEBUG: Updated StaffPayment #{linked_staff_payment.id} from {old_amt} to {amount}")
-                        # If paid from bank, also update the bank entry
-                        if linked_staff_payment.bank_entry_id:
-                            bank_entry = BalanceEntry.query.get(linked_staff_payment.bank_entry_id)
-                            if bank_entry:
-                                bank_entry.debit = amount
-                                flash(f"DEBUG: Updated BankEntry #{bank_entry.id}")
-                    else:
-                        # Check if this is a Salary expense but no linked payment found
-                        if expense.category == "Salary":
-                            flash(f"DEBUG: Salary expense #{expense.id} has NO linked StaffPayment!")
-                    
-                    # Also update linked SupplierPayment if exists
-                    linked_supplier_payment = SupplierPayment.query.filter_by(expense_id=expense.id).first()
-                    if linked_supplier_payment:
-                        linked_supplier_payment.amount = amount
-                        flash(f"DEBUG: Updated SupplierPayment #{linked_supplier_payment.id} from {old_amt} to {amount}")
-                        # If paid from bank, also update the bank entry
-                        if linked_supplier_payment.bank_entry_id:
-                            bank_entry = BalanceEntry.query.get(linked_supplier_payment.bank_entry_id)
-                            if bank_entry:
-                                bank_entry.debit = amount
-                    else:
-                        if expense.category == "Supplier":
-                            flash(f"DEBUG: Supplier expense #{expense.id} has NO linked SupplierPayment!")
-                
+
+                    # Keep the salary / supplier payment and its bank entry in step
+                    linked = payments_by_expense.get(expense.id, [])
+                    for payment in linked:
+                        payment.amount = amount
+                        bank_entry = bank_by_id.get(payment.bank_entry_id)
+                        if bank_entry and bank_entry.debit != amount:
+                            bank_entry.debit = amount
+                            bank_dates.append(bank_entry.date)
+                    if not linked and expense.category in ("Salary", "Supplier"):
+                        flash(f"{expense.category} expense #{expense.id} has no linked payment; "
+                              f"only the expense was changed.")
+
                 if changed:
                     updated_count += 1
-            
+
+            # Updates go out in one flush; balances only move if a debit did
+            if bank_dates:
+                rebalance_bank_from(min(bank_dates))
             db.session.commit()
-            
-            # Recalculate bank balances if any bank entries were affected
-            recalc_bank_balances()
-            
+
             if deleted_count > 0:
                 flash(f"Deleted {deleted_count} expense(s).")
             if updated_count > 0:
@@ -2767,7 +4974,7 @@ def edit_expense():
                 flash("No changes detected.")
             
             # Reload expenses for the date
-            expenses = Expense.query.filter_by(date=selected_date).order_by(Expense.id).all()
+            expenses = list_query(Expense).filter_by(date=selected_date).order_by(Expense.id).all()
     
     templates = ExpenseTemplate.query.order_by(ExpenseTemplate.name).all()
     return render_template(
@@ -2852,160 +5059,626 @@ def bulk_expense():
 
 
 # ============================================================
-#  Database Init & Tiny Migrations
+#  CSV Import – validated while streaming, inserted in batches
 # ============================================================
+# Each batch is one executemany INSERT. Bulk inserts skip the flush
+# hook, so the ledger/rollup deltas are folded here and applied once,
+# and bank balances are rebalanced once from the earliest imported date.
 
-with app.app_context():
-    # Create all tables if not exist
-    db.create_all()
-
-    # -------------------------
-    # Ensure default SUPERADMIN
-    # -------------------------
-    superadmin = User.query.filter_by(username="dp_mamun").first()
-    if not superadmin:
-        superadmin = User(username="dp_mamun", role="superadmin")
-        superadmin.set_password("supersecret")  # change after first login
-        db.session.add(superadmin)
-        db.session.commit()
-        
-    else:
-        if superadmin.role != "superadmin":
-            superadmin.role = "superadmin"
-            db.session.commit()
-            print("Updated existing 'dp_mamun' to SUPERADMIN")
-
-    # -------------------------
-    # Ensure default staff
-    # -------------------------
-    staff_user = User.query.filter_by(username="staff").first()
-    if not staff_user:
-        staff_user = User(username="staff", role="employee")
-        staff_user.set_password("staff123")
-        db.session.add(staff_user)
-        db.session.commit()
-        
-    else:
-        if staff_user.role != "employee":
-            staff_user.role = "employee"
-            db.session.commit()
-            print("Updated existing 'staff' to EMPLOYEE")
+IMPORT_BATCH = 1000
+IMPORT_REJECTS_SHOWN = 200
+IMPORT_DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y")
 
-    # -------------------------
-    # Tiny auto-migrations for old DBs
-    # -------------------------
-    try:
-        db.session.execute(text("SELECT role FROM users LIMIT 1"))
-        db.session.commit()
-    except Exception:
-        try:
-            db.session.execute(
-                text("ALTER TABLE users ADD COLUMN role VARCHAR(20) NOT NULL DEFAULT 'employee'")
-            )
-            db.session.commit()
-            print("Added 'role' column to users table")
-        except Exception:
-            db.session.rollback()
 
-    # days.created_at
-    try:
-        db.session.execute(text("SELECT created_at FROM days LIMIT 1"))
-        db.session.commit()
-    except Exception:
+def _csv_date(value: str):
+    for fmt in IMPORT_DATE_FORMATS:
         try:
-            db.session.execute(text("ALTER TABLE days ADD COLUMN created_at DATETIME"))
-            db.session.commit()
-            print("Added 'created_at' column to days table")
-        except Exception:
-            db.session.rollback()
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"invalid date '{value}' (use YYYY-MM-DD)")
 
-    # expenses.created_at
-    try:
-        db.session.execute(text("SELECT created_at FROM expenses LIMIT 1"))
-        db.session.commit()
-    except Exception:
-        try:
-            db.session.execute(text("ALTER TABLE expenses ADD COLUMN created_at DATETIME"))
-            db.session.commit()
-            print("Added 'created_at' column to expenses table")
-        except Exception:
-            db.session.rollback()
 
-    # doctor_bills.created_at
+def _csv_number(row: dict, column: str, required: bool = False) -> float:
+    value = row.get(column, "").replace(",", "")
+    if not value:
+        if required:
+            raise ValueError(f"{column} is missing")
+        return 0.0
     try:
-        db.session.execute(text("SELECT created_at FROM doctor_bills LIMIT 1"))
-        db.session.commit()
-    except Exception:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"{column} '{value}' is not a number")
+    if number < 0:
+        raise ValueError(f"{column} cannot be negative")
+    return number
+
+
+def _csv_text(value: str, column) -> str:
+    """`value` for a String(n) column; too long is a reject, not a database error."""
+    limit = column.type.length
+    if limit and len(value) > limit:
+        raise ValueError(f"{column.name} is longer than {limit} characters")
+    return value
+
+
+def _parse_expense_row(row: dict) -> dict:
+    amount = _csv_number(row, "amount", required=True)
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    return {
+        "date": _csv_date(row.get("date", "")),
+        "category": _csv_text(row.get("category") or "General", Expense.__table__.c.category),
+        "description": _csv_text(row.get("description", ""), Expense.__table__.c.description),
+        "amount": amount,
+    }
+
+
+def _parse_day_row(row: dict) -> dict:
+    new = _csv_number(row, "collect_soft_new")
+    old = _csv_number(row, "collect_soft_old")
+    return {
+        "date": _csv_date(row.get("date", "")),
+        "collect_soft_new": new,
+        "collect_soft_old": old,
+        "total_collection": new + old,
+        "tvs_qty": int(_csv_number(row, "tvs_qty")),
+        "ult_qty": int(_csv_number(row, "ult_qty")),
+        "pc_qty": int(_csv_number(row, "pc_qty")),
+        "notes": row.get("notes", ""),
+    }
+
+
+def _parse_lab_row(row: dict) -> dict:
+    amount = _csv_number(row, "amount", required=True)
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    return {
+        "date": _csv_date(row.get("date", "")),
+        "amount": amount,
+        "note": _csv_text(row.get("note", ""), LabCollection.__table__.c.note),
+    }
+
+
+def _parse_bank_row(row: dict) -> dict:
+    credit = _csv_number(row, "credit")
+    debit = _csv_number(row, "debit")
+    if (credit > 0) == (debit > 0):
+        raise ValueError("exactly one of credit / debit must be positive")
+    return {
+        "date": _csv_date(row.get("date", "")),
+        "description": _csv_text(row.get("description", ""), BalanceEntry.__table__.c.description),
+        "credit": credit,
+        "debit": debit,
+    }
+
+
+@dataclass
+class ImportSpec:
+    title: str
+    model: type
+    columns: list               # CSV header, required ones first
+    required: tuple
+    parse: object               # normalised row dict -> column values (ValueError = reject)
+    one_per_date: bool = False
+
+
+IMPORTS = {
+    "expenses": ImportSpec("Expenses", Expense,
+                           ["date", "category", "amount", "description"],
+                           ("date", "amount"), _parse_expense_row),
+    "days": ImportSpec("Day summaries", DaySummary,
+                       ["date", "collect_soft_new", "collect_soft_old", "notes",
+                        "tvs_qty", "ult_qty", "pc_qty"],
+                       ("date",), _parse_day_row, one_per_date=True),
+    "lab": ImportSpec("Lab collections", LabCollection,
+                      ["date", "amount", "note"],
+                      ("date", "amount"), _parse_lab_row, one_per_date=True),
+    "bank": ImportSpec("Bank entries", BalanceEntry,
+                       ["date", "credit", "debit", "description"],
+                       ("date",), _parse_bank_row),
+}
+
+
+@dataclass
+class ImportResult:
+    dataset: str
+    dry_run: bool
+    read: int = 0
+    imported: int = 0
+    rejected: int = 0
+    rejects: list = field(default_factory=list)   # (CSV line, message), first few only
+
+    def reject(self, line: int, message: str):
+        self.rejected += 1
+        if len(self.rejects) < IMPORT_REJECTS_SHOWN:
+            self.rejects.append((line, message))
+
+
+def _insert_import_batch(spec: ImportSpec, batch: list, result: ImportResult,
+                         user_id: int, deltas: tuple) -> None:
+    """Drop rows whose date is taken (one-per-date tables), then INSERT the rest."""
+    model = spec.model
+    if spec.one_per_date and batch:
+        taken = {
+            d for (d,) in db.session.query(model.date).filter(
+                model.date.in_([values["date"] for _, values in batch])
+            )
+        }
+        for line, values in batch:
+            if values["date"] in taken:
+                result.reject(line, f"{values['date']} already has an entry")
+        batch = [(line, values) for line, values in batch if values["date"] not in taken]
+
+    if not batch:
+        return
+    result.imported += len(batch)
+    if result.dry_run:
+        return
+
+    now = datetime.now()
+    stamp = {"created_by_id": user_id}
+    if "created_at" in model.__table__.c:
+        stamp["created_at"] = now
+    rows = [dict(values, **stamp) for _, values in batch]
+
+    if model is LabCollection:
+        # Lab collections need a day summary for their date, as in lab_collection()
+        dates = [row["date"] for row in rows]
+        have = {d for (d,) in db.session.query(DaySummary.date).filter(DaySummary.date.in_(dates))}
+        missing = [{"date": d, "collect_soft_new": 0, "collect_soft_old": 0,
+                    "total_collection": 0, "notes": "", "created_by_id": user_id,
+                    "created_at": now} for d in dates if d not in have]
+        if missing:
+            db.session.execute(db.insert(DaySummary), missing)
+
+    db.session.execute(db.insert(model), rows)
+    for row in rows:
+        fold_ledger_row(model, row, 1, *deltas)
+
+
+def run_import(dataset: str, lines, user_id: int, dry_run: bool = False) -> ImportResult:
+    """
+    Import CSV `lines` (an iterable of str) into the `dataset` table of
+    IMPORTS. Invalid rows are rejected with their line number; the rest
+    go in IMPORT_BATCH at a time. No commit here. Raises ValueError when
+    required columns are missing.
+    """
+    spec = IMPORTS[dataset]
+    result = ImportResult(dataset, dry_run)
+    reader = csv.reader(lines)
+
+    header = [h.strip().lower().replace(" ", "_") for h in next(reader, [])]
+    missing = [c for c in spec.required if c not in header]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    deltas = ({}, {}, {})   # totals, daily, by_category
+    seen_dates = set()
+    batch = []
+    for raw in reader:
+        if not any(cell.strip() for cell in raw):
+            continue
+        result.read += 1
+        row = {name: cell.strip() for name, cell in zip(header, raw)}
         try:
-            db.session.execute(text("ALTER TABLE doctor_bills ADD COLUMN created_at DATETIME"))
-            db.session.commit()
-            print("Added 'created_at' column to doctor_bills table")
-        except Exception:
-            db.session.rollback()
+            values = spec.parse(row)
+        except ValueError as e:
+            result.reject(reader.line_num, str(e))
+            continue
+        if spec.one_per_date:
+            if values["date"] in seen_dates:
+                result.reject(reader.line_num, f"{values['date']} appears twice in the file")
+                continue
+            seen_dates.add(values["date"])
+
+        batch.append((reader.line_num, values))
+        if len(batch) >= IMPORT_BATCH:
+            _insert_import_batch(spec, batch, result, user_id, deltas)
+            batch = []
+    _insert_import_batch(spec, batch, result, user_id, deltas)
+
+    if not dry_run and result.imported:
+        totals, daily, by_category = deltas
+        apply_ledger_totals(totals)
+        apply_daily_rollups(daily, by_category)
+        if spec.model is BalanceEntry:
+            rebalance_bank_from(min(daily))
+    return result
+
+
+@app.route("/import", methods=["GET", "POST"])
+@admin_required
+def import_data():
+    """Upload a CSV of expenses, day summaries, lab collections or bank entries."""
+    result = None
+    if request.method == "POST":
+        dataset = request.form.get("dataset")
+        upload = request.files.get("file")
+        dry_run = request.form.get("dry_run") == "1"
+
+        if dataset not in IMPORTS or not upload or not upload.filename:
+            flash("Choose what to import and a CSV file.")
+            return redirect(url_for("import_data"))
 
-    # staff_payments.expense_id
-    try:
-        db.session.execute(text("SELECT expense_id FROM staff_payments LIMIT 1"))
-        db.session.commit()
-    except Exception:
         try:
-            db.session.execute(text("ALTER TABLE staff_payments ADD COLUMN expense_id INTEGER"))
-            db.session.commit()
-            print("Added 'expense_id' column to staff_payments table")
-        except Exception:
+            # Decoded line by line so the upload is never read in one go
+            lines = (raw.decode("utf-8-sig") for raw in upload.stream)
+            result = run_import(dataset, lines, g.user.id, dry_run=dry_run)
+            if dry_run:
+                db.session.rollback()
+            else:
+                db.session.commit()
+        except UnicodeDecodeError:
             db.session.rollback()
+            flash("The file is not UTF-8 text. Save it as CSV (UTF-8) and try again.")
+            return redirect(url_for("import_data"))
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e))
+            return redirect(url_for("import_data"))
+
+        if dry_run:
+            flash(f"Dry run: {result.imported} row(s) would be imported, "
+                  f"{result.rejected} rejected. Nothing was saved.")
+        else:
+            flash(f"Imported {result.imported} row(s), {result.rejected} rejected.")
+
+    return render_template("import_data.html", imports=IMPORTS, result=result)
+
+
+# ============================================================
+#  Index Advisor
+# ============================================================
+
+# (name, SQL) of the queries the busiest pages depend on
+HOT_QUERIES = [
+    ("dashboard: day summaries in range",
+     "SELECT * FROM days WHERE date >= :start AND date <= :end ORDER BY date DESC"),
+    ("dashboard: expenses in range",
+     "SELECT * FROM expenses WHERE date >= :start AND date <= :end ORDER BY date DESC, id DESC"),
+    ("report: expenses of one category",
+     "SELECT * FROM expenses WHERE category = :category AND date >= :start AND date <= :end ORDER BY date"),
+    ("dashboard, report: daily rollups in range",
+     "SELECT * FROM daily_rollups WHERE date >= :start AND date <= :end"),
+    ("lab collection: row for a date",
+     "SELECT * FROM lab_collections WHERE date = :start"),
+    ("bank: ledger history",
+     "SELECT * FROM balance_entries ORDER BY date DESC, id DESC LIMIT 50"),
+    ("bank: rebalance suffix",
+     "SELECT id, date, credit, debit, balance_after FROM balance_entries "
+     "WHERE (date, id) >= (:start, :id) ORDER BY date, id"),
+    ("delete expense: linked staff payments",
+     "SELECT * FROM staff_payments WHERE expense_id = :id"),
+    ("delete expense: linked supplier payments",
+     "SELECT * FROM supplier_payments WHERE expense_id = :id"),
+    ("delete payment: linked bank entry (staff)",
+     "SELECT * FROM staff_payments WHERE bank_entry_id = :id"),
+    ("staffs: one staff's month payments",
+     "SELECT * FROM staff_payments WHERE staff_id = :id AND date >= :start AND date <= :end"),
+    ("staffs: all payments in a month",
+     "SELECT * FROM staff_payments WHERE date >= :start AND date <= :end"),
+    ("staffs: salary changes of one staff",
+     "SELECT * FROM staff_monthly_salaries WHERE staff_id = :id ORDER BY year DESC, month DESC"),
+    ("supplier report: bills in range",
+     "SELECT * FROM supplier_bills WHERE supplier_id = :id AND date >= :start AND date <= :end ORDER BY date, id"),
+    ("supplier report: payments in range",
+     "SELECT * FROM supplier_payments WHERE supplier_id = :id AND date >= :start AND date <= :end ORDER BY date, id"),
+    ("delete history",
+     "SELECT * FROM delete_logs ORDER BY timestamp DESC LIMIT 500"),
+]
+
+
+def _is_full_scan(plan_line: str) -> bool:
+    if db.engine.dialect.name == "postgresql":
+        return "Seq Scan" in plan_line
+    # SQLite: "SCAN t" is a full scan, "SCAN t USING INDEX ..." walks an index
+    return plan_line.startswith("SCAN ") and " USING " not in plan_line
+
+
+def explain_query(sql: str, params: dict) -> list:
+    """Query plan lines for `sql` on the current database."""
+    if db.engine.dialect.name == "postgresql":
+        # Small tables are always seq-scanned; make the planner prove an index exists
+        db.session.execute(text("SET LOCAL enable_seqscan = off"))
+        lines = [row[0] for row in db.session.execute(text("EXPLAIN " + sql), params)]
+    else:
+        lines = [row[-1] for row in db.session.execute(text("EXPLAIN QUERY PLAN " + sql), params)]
+    db.session.rollback()
+    return lines
 
-    # staff_payments.bank_entry_id
+
+def run_index_advisor() -> list:
+    """
+    EXPLAIN every hot query against the current database.
+    Returns [{"name", "plan", "full_scans"}], full_scans listing the plan
+    lines that read a whole table.
+    """
+    today = datetime.today().date()
+    params = {"start": today.replace(day=1), "end": today, "id": 1, "category": "Salary"}
+
+    report = []
+    for name, sql in HOT_QUERIES:
+        plan = explain_query(sql, params)
+        report.append({
+            "name": name,
+            "plan": plan,
+            "full_scans": [line for line in plan if _is_full_scan(line)],
+        })
+    return report
+
+
+# ============================================================
+#  CLI Commands
+# ============================================================
+
+@app.cli.command("db-upgrade")
+def db_upgrade_command():
+    """Apply pending schema migrations (safe to run on every deploy)."""
+    applied = run_migrations()
+    if not applied:
+        print(f"Schema is up to date (version {LATEST_SCHEMA_VERSION}).")
+
+
+@app.cli.command("db-version")
+def db_version_command():
+    """Show the applied schema version."""
+    print(f"Schema version {current_schema_version()} of {LATEST_SCHEMA_VERSION}.")
+
+
+@app.cli.command("rebuild-bank-balances")
+def rebuild_bank_balances_command():
+    """Full rebuild of balance_after for every bank entry (repair)."""
+    recalc_bank_balances()
+    print("Bank balances rebuilt.")
+
+
+@app.cli.command("verify-totals")
+@click.option("--repair", is_flag=True, help="Rebuild totals and rollups if they have drifted.")
+def verify_totals_command(repair):
+    """Compare the running totals, daily rollups and supplier totals with live aggregates."""
+    mismatches = verify_ledger_totals(repair=repair)
+    for col, stored, live in mismatches:
+        print(f"{col}: stored={stored} live={live}")
+    if not mismatches:
+        print("Running totals match the ledger.")
+    elif repair:
+        print("Running totals rebuilt.")
+
+    bad_dates = verify_daily_rollups(repair=repair)
+    for day in bad_dates:
+        print(f"daily rollup mismatch on {day}")
+    if not bad_dates:
+        print("Daily rollups match the ledger.")
+    elif repair:
+        print("Daily rollups rebuilt.")
+
+    drifted = verify_supplier_totals(repair=repair)
+    for supplier_id, col, stored, live in drifted:
+        print(f"supplier {supplier_id} {col}: stored={stored} live={live}")
+    if not drifted:
+        print("Supplier totals match bills and payments.")
+    elif repair:
+        print("Supplier totals repaired.")
+
+
+@app.cli.command("index-advisor")
+def index_advisor_command():
+    """EXPLAIN the hot queries and report any full table scans."""
+    report = run_index_advisor()
+    for item in report:
+        status = "SEQ SCAN" if item["full_scans"] else "ok"
+        print(f"[{status:8}] {item['name']}")
+        for line in item["full_scans"]:
+            print(f"           {line}")
+
+    flagged = sum(1 for item in report if item["full_scans"])
+    print(f"{len(report)} queries checked, {flagged} with full table scans.")
+    if flagged:
+        raise SystemExit(1)
+
+
+# ============================================================
+#  Schema Migrations (versioned, each runs once)
+# ============================================================
+# Every migration is idempotent so it is also safe on databases that
+# were set up by the old import-time probes. Add new ones at the end
+# with the next version number.
+
+MIGRATIONS = []
+
+
+def migration(version: int, name: str):
+    def register(fn):
+        MIGRATIONS.append((version, name, fn))
+        return fn
+    return register
+
+
+def _add_missing_columns(columns: dict):
+    """columns: {table: [(column, DDL type), ...]} – adds those not present yet."""
+    inspector = inspect(db.session.connection())
+    for table, wanted in columns.items():
+        if not inspector.has_table(table):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table)}
+        for column, ddl in wanted:
+            if column not in existing:
+                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+                print(f"Added '{column}' column to {table} table")
+
+
+@migration(1, "create tables")
+def _create_tables():
+    db.metadata.create_all(bind=db.session.connection())
+
+
+@migration(2, "columns added after first release")
+def _legacy_columns():
+    columns = {
+        "users": [("role", "VARCHAR(20) NOT NULL DEFAULT 'employee'")],
+        "days": [("created_at", "TIMESTAMP")],
+        "expenses": [("created_at", "TIMESTAMP")],
+        "doctor_bills": [("created_at", "TIMESTAMP")],
+        "staff_payments": [("expense_id", "INTEGER"), ("bank_entry_id", "INTEGER")],
+        "supplier_payments": [("expense_id", "INTEGER"), ("bank_entry_id", "INTEGER")],
+    }
+    for table in ["days", "expenses", "doctor_bills", "balance_entries", "staff_payments",
+                  "supplier_bills", "supplier_payments", "lab_collections"]:
+        columns.setdefault(table, []).append(("created_by_id", "INTEGER"))
+    _add_missing_columns(columns)
+
+
+@migration(3, "default users")
+def _default_users():
+    for username, role, password in [
+        ("dp_mamun", "superadmin", "supersecret"),  # change after first login
+        ("staff", "employee", "staff123"),
+    ]:
+        user = User.query.filter_by(username=username).first()
+        if not user:
+            user = User(username=username, role=role)
+            user.set_password(password)
+            db.session.add(user)
+        elif user.role != role:
+            user.role = role
+            print(f"Updated existing '{username}' to {role.upper()}")
+
+
+@migration(4, "model indexes")
+def _model_indexes():
+    # create_all skips tables that already exist, and with them their indexes
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.session.connection(), checkfirst=True)
+
+
+@migration(5, "seed ledger totals")
+def _seed_ledger_totals():
+    if db.session.get(LedgerTotals, 1) is None:
+        rebuild_ledger_totals()
+        db.session.flush()
+        print("Seeded ledger_totals from existing data")
+
+
+@migration(6, "backfill daily rollups")
+def _backfill_daily_rollups():
+    if DailyRollup.query.first() is None:
+        rebuild_daily_rollups()
+        if DailyRollup.query.first() is not None:
+            print("Backfilled daily_rollups from existing data")
+
+
+@migration(7, "table versions")
+def _table_versions():
+    TableVersion.__table__.create(bind=db.session.connection(), checkfirst=True)
+
+
+@migration(8, "supplier paid totals")
+def _supplier_paid_totals():
+    _add_missing_columns({"suppliers": [("total_paid", "FLOAT DEFAULT 0")]})
+    mismatches = verify_supplier_totals()
+    if mismatches:
+        repair_supplier_totals(mismatches)
+        print("Backfilled supplier totals from bills and payments")
+
+
+LATEST_SCHEMA_VERSION = max(version for version, _, _ in MIGRATIONS)
+
+
+def current_schema_version() -> int:
+    """
+    Highest applied migration; 0 when schema_version does not exist yet.
+    One statement: a missing table shows up as the query's error.
+    """
+    query = db.session.query(db.func.max(SchemaVersion.version))
     try:
-        db.session.execute(text("SELECT bank_entry_id FROM staff_payments LIMIT 1"))
-        db.session.commit()
-    except Exception:
+        return query.scalar() or 0
+    except (OperationalError, ProgrammingError):
+        # The failed statement aborts the transaction on Postgres
+        db.session.rollback()
+        if not inspect(db.session.connection()).has_table(SchemaVersion.__tablename__):
+            return 0
+    # The table is there (maybe just created by another worker): any
+    # other error repeats and is raised
+    return query.scalar() or 0
+
+
+MIGRATION_LOCK_KEY = 7262901   # pg_advisory_xact_lock key, any constant
+MIGRATION_LOCK_TIMEOUT = int(os.getenv("MIGRATION_LOCK_TIMEOUT", "300"))  # seconds (SQLite)
+
+
+def lock_migrations() -> None:
+    """
+    Start a transaction that holds the database-wide migration lock until
+    it ends, so concurrently booting workers migrate one at a time.
+    PostgreSQL takes a transaction-level advisory lock; SQLite takes the
+    write lock with BEGIN IMMEDIATE, retried while another worker has it.
+    """
+    db.session.rollback()
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        return
+    deadline = time.monotonic() + MIGRATION_LOCK_TIMEOUT
+    while True:
         try:
-            db.session.execute(text("ALTER TABLE staff_payments ADD COLUMN bank_entry_id INTEGER"))
-            db.session.commit()
-            print("Added 'bank_entry_id' column to staff_payments table")
-        except Exception:
+            db.session.execute(text("BEGIN IMMEDIATE"))
+            return
+        except OperationalError as e:
             db.session.rollback()
+            if "locked" not in str(e) or time.monotonic() > deadline:
+                raise
+            time.sleep(0.2)
 
-    # supplier_payments.expense_id and bank_entry_id
+
+def run_migrations() -> list:
+    """
+    Apply every migration newer than the recorded version, in order. Each
+    one runs under the migration lock, in one transaction with its
+    SchemaVersion row: the version is re-read inside the lock, so a
+    migration another worker just applied is skipped, and a failing one
+    is rolled back and re-raised.
+    """
+    lock_migrations()
     try:
-        db.session.execute(text("SELECT expense_id FROM supplier_payments LIMIT 1"))
+        SchemaVersion.__table__.create(bind=db.session.connection(), checkfirst=True)
         db.session.commit()
     except Exception:
-        try:
-            db.session.execute(text("ALTER TABLE supplier_payments ADD COLUMN expense_id INTEGER"))
-            db.session.execute(text("ALTER TABLE supplier_payments ADD COLUMN bank_entry_id INTEGER"))
-            db.session.commit()
-            print("Added 'expense_id' and 'bank_entry_id' columns to supplier_payments")
-        except Exception:
-            db.session.rollback()
+        db.session.rollback()
+        raise
 
-    # -------------------------
-    # Add created_by_id columns to all transactional tables
-    # -------------------------
-    tables_needing_created_by = [
-        "days",
-        "expenses", 
-        "doctor_bills",
-        "balance_entries",
-        "staff_payments",
-        "supplier_bills",
-        "supplier_payments",
-        "lab_collections",
-    ]
-    
-    for table in tables_needing_created_by:
+    applied = []
+    for version, name, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        lock_migrations()
         try:
-            db.session.execute(text(f"SELECT created_by_id FROM {table} LIMIT 1"))
+            if version <= current_schema_version():
+                db.session.rollback()
+                continue
+            fn()
+            db.session.add(SchemaVersion(version=version, name=name))
             db.session.commit()
         except Exception:
             db.session.rollback()
-            try:
-                db.session.execute(text(f"ALTER TABLE {table} ADD COLUMN created_by_id INTEGER"))
-                db.session.commit()
-                print(f"Added 'created_by_id' column to {table} table")
-            except Exception:
-                db.session.rollback()
+            raise
+        applied.append(version)
+        print(f"Applied migration {version}: {name}")
+    return applied
+
+
+# Worker import: one version check; migrate only when behind.
+# Set AUTO_MIGRATE=0 to leave that to `flask --app app db-upgrade`.
+with app.app_context():
+    if current_schema_version() < LATEST_SCHEMA_VERSION:
+        if os.getenv("AUTO_MIGRATE", "1") == "1":
+            run_migrations()
+        else:
+            print("⚠️  Database schema is behind. Run: flask --app app db-upgrade")
+
+    # Optional index advisor run at startup (INDEX_ADVISOR=1)
+    if os.getenv("INDEX_ADVISOR") == "1":
+        for item in run_index_advisor():
+            for line in item["full_scans"]:
+                print(f"⚠️  Index advisor: {item['name']}: {line}")
 
 
 # ============================================================
@@ -0,0 +1,146 @@
+"""
+Benchmark: /report aggregation – report engine vs. the old per-section queries.
+
+Seeds a throwaway SQLite database (or uses DATABASE_URL if set) with
+a year of activity, then builds the same "all" report both ways and
+prints statements issued and average latency.
+
+    python benchmarks/bench_report.py [--days 365] [--runs 20]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--days", type=int, default=365)
+parser.add_argument("--runs", type=int, default=20)
+args = parser.parse_args()
+
+if not os.getenv("DATABASE_URL"):
+    db_file = os.path.join(tempfile.mkdtemp(), "bench_report.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + db_file
+
+import app as m  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+db = m.db
+CATEGORIES = ["Rent", "Salary", "Utilities", "Supplies", "Transport"]
+DOCTORS = [("Dr. A", "USG"), ("Dr. B", "TVS"), ("Dr. C", "X-Ray")]
+
+
+def seed(days: int):
+    if m.DaySummary.query.count():
+        return
+    rnd = random.Random(1)
+    start = date.today() - timedelta(days=days)
+    for i in range(days):
+        d = start + timedelta(days=i)
+        new, old = rnd.randint(1000, 5000), rnd.randint(0, 2000)
+        db.session.add(m.DaySummary(
+            date=d, collect_soft_new=new, collect_soft_old=old,
+            total_collection=new + old,
+        ))
+        db.session.add(m.LabCollection(date=d, amount=rnd.randint(100, 900)))
+        for _ in range(rnd.randint(3, 12)):
+            db.session.add(m.Expense(
+                date=d, category=rnd.choice(CATEGORIES),
+                description="bench", amount=rnd.randint(10, 500),
+            ))
+        for _ in range(rnd.randint(1, 6)):
+            doctor, modality = rnd.choice(DOCTORS)
+            db.session.add(m.DoctorBill(
+                date=d, doctor_name=doctor, modality=modality,
+                amount=rnd.randint(50, 400),
+            ))
+    db.session.commit()
+
+
+def legacy_report(start, end):
+    """The per-section query sequence report() ran before the engine."""
+    days = m.DaySummary.query.filter(
+        m.DaySummary.date >= start, m.DaySummary.date <= end
+    ).order_by(m.DaySummary.date).all()
+    rollups = m.DailyRollup.query.filter(
+        m.DailyRollup.date >= start, m.DailyRollup.date <= end
+    ).all()
+    total_collection = sum(r.total_collection or 0 for r in rollups) + \
+        sum(r.total_lab or 0 for r in rollups)
+
+    expenses_list = m.Expense.query.filter(
+        m.Expense.date >= start, m.Expense.date <= end
+    ).order_by(m.Expense.date).all()
+    breakdown = db.session.query(
+        m.DailyExpenseRollup.category, db.func.sum(m.DailyExpenseRollup.amount)
+    ).filter(
+        m.DailyExpenseRollup.date >= start, m.DailyExpenseRollup.date <= end
+    ).group_by(m.DailyExpenseRollup.category).having(
+        db.func.sum(m.DailyExpenseRollup.amount) != 0
+    ).order_by(m.DailyExpenseRollup.category).all()
+    total_expenses = sum(t for _, t in breakdown)
+
+    bills = m.DoctorBill.query.filter(
+        m.DoctorBill.date >= start, m.DoctorBill.date <= end
+    ).order_by(m.DoctorBill.date).all()
+    total_doctor_bills = db.session.query(
+        db.func.sum(m.DailyRollup.total_doctor_bills)
+    ).filter(m.DailyRollup.date >= start, m.DailyRollup.date <= end).scalar() or 0
+    doctor_breakdown = db.session.query(
+        m.DoctorBill.doctor_name, m.DoctorBill.modality, db.func.sum(m.DoctorBill.amount)
+    ).filter(
+        m.DoctorBill.date >= start, m.DoctorBill.date <= end
+    ).group_by(m.DoctorBill.doctor_name, m.DoctorBill.modality).order_by(
+        m.DoctorBill.doctor_name, m.DoctorBill.modality
+    ).all()
+    return (days, expenses_list, bills, doctor_breakdown,
+            round(total_collection, 2), round(total_expenses, 2),
+            round(total_doctor_bills, 2))
+
+
+def engine_report(start, end):
+    rep = m.build_finance_report(start, end)
+    return (rep.days, rep.expenses_list, rep.doctor_bills_list, rep.doctor_breakdown,
+            round(rep.total_collection, 2), round(rep.total_expenses, 2),
+            round(rep.total_doctor_bills, 2))
+
+
+def measure(fn, start, end, runs: int):
+    statements = []
+
+    def count(*_):
+        statements.append(1)
+
+    event.listen(db.engine, "before_cursor_execute", count)
+    try:
+        result = fn(start, end)
+        per_call = len(statements)
+        began = time.perf_counter()
+        for _ in range(runs):
+            fn(start, end)
+            db.session.expire_all()
+        elapsed = (time.perf_counter() - began) / runs
+    finally:
+        event.remove(db.engine, "before_cursor_execute", count)
+    return result, per_call, elapsed
+
+
+with m.app.app_context():
+    seed(args.days)
+    end = date.today()
+    start = end - timedelta(days=args.days)
+
+    old, old_q, old_t = measure(legacy_report, start, end, args.runs)
+    new, new_q, new_t = measure(engine_report, start, end, args.runs)
+    assert old[4:] == new[4:], (old[4:], new[4:])
+    assert len(old[0]) == len(new[0]) and len(old[1]) == len(new[1])
+    assert [tuple(r) for r in old[3]] == [tuple(r) for r in new[3]]
+
+    print(f"{'':<10}{'queries':>10}{'avg ms':>12}")
+    print(f"{'legacy':<10}{old_q:>10}{old_t * 1000:>12.2f}")
+    print(f"{'engine':<10}{new_q:>10}{new_t * 1000:>12.2f}")
@@ -0,0 +1,60 @@
+"""
+Benchmark: worker start-up – time and SQL statements spent importing app.py.
+
+Each run imports the app in a fresh interpreter (as a gunicorn worker
+does) against the same database. The first import on a new database
+applies the migrations; every later one should be a single version check.
+
+    python benchmarks/bench_startup.py [--runs 5]
+
+Uses DATABASE_URL if set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+statements = []
+event.listen(Engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+
+began = time.perf_counter()
+import app
+elapsed = time.perf_counter() - began
+print(f"RESULT {elapsed:.6f} {len(statements)}")
+"""
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--runs", type=int, default=5)
+args = parser.parse_args()
+
+env = dict(os.environ)
+if not env.get("DATABASE_URL"):
+    env["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench_startup.db")
+
+
+def import_once():
+    out = subprocess.run(
+        [sys.executable, "-c", PROBE], cwd=ROOT, env=env,
+        capture_output=True, text=True, check=True,
+    ).stdout
+    line = next(l for l in out.splitlines() if l.startswith("RESULT "))
+    _, seconds, statements = line.split()
+    return float(seconds), int(statements)
+
+
+first_time, first_statements = import_once()
+warm = [import_once() for _ in range(args.runs)]
+
+print(f"{'':<18}{'statements':>12}{'import ms':>12}")
+print(f"{'first (migrate)':<18}{first_statements:>12}{first_time * 1000:>12.1f}")
+print(f"{'warm (median)':<18}{statistics.median(s for _, s in warm):>12.0f}"
+      f"{statistics.median(t for t, _ in warm) * 1000:>12.1f}")
@@ -0,0 +1,152 @@
+"""
+Check: list pages must issue a fixed number of SQL statements.
+
+Renders every page that lists rows with a "created by" column, first
+with a few rows and then with several times more, each row written by
+a different user (so lazy created_by loads cannot hide behind the
+identity map). Exits 1 if any page's statement count grows with the
+number of rows. Also checks that a cached bank statement for an
+earlier month is still served from the report cache after a bank
+write dated in a later month.
+
+    python benchmarks/check_query_counts.py [--small 3] [--large 12]
+
+Always runs against a throwaway SQLite database.
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--small", type=int, default=3)
+parser.add_argument("--large", type=int, default=12)
+args = parser.parse_args()
+
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "query_counts.db")
+
+import app as m  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+db = m.db
+MONTH_START = date(2024, 1, 1)
+
+
+def seed_owners():
+    with m.app.app_context():
+        staff = m.Staff(name="Check staff", salary=1000)
+        supplier = m.Supplier(name="Check supplier", total_due=0)
+        db.session.add_all([staff, supplier])
+        db.session.commit()
+        return staff.id, supplier.id
+
+
+def add_rows(start: int, stop: int, staff_id: int, supplier_id: int):
+    """Rows start..stop-1, each created by its own user."""
+    with m.app.app_context():
+        for i in range(start, stop):
+            user = m.User(username=f"check_user_{i}", role="employee")
+            user.set_password("x")
+            db.session.add(user)
+            db.session.flush()
+
+            d = MONTH_START + timedelta(days=i % 28)
+            by = dict(created_by_id=user.id)
+            if not m.DaySummary.query.filter_by(date=d).first():
+                db.session.add(m.DaySummary(date=d, total_collection=100, **by))
+            db.session.add_all([
+                m.Expense(date=MONTH_START, category="Check", amount=1, **by),
+                m.LabCollection(date=d, amount=5, **by),
+                m.BalanceEntry(date=d, description="check", credit=10, debit=0, **by),
+                m.StaffPayment(staff_id=staff_id, date=d, amount=1, source="cash", **by),
+                m.SupplierBill(supplier_id=supplier_id, date=d, amount=2, **by),
+                m.SupplierPayment(supplier_id=supplier_id, date=d, amount=1, source="cash", **by),
+            ])
+        db.session.commit()
+        m.recalc_bank_balances()
+
+
+def pages(staff_id: int, supplier_id: int):
+    month = {"start_date": "2024-01-01", "end_date": "2024-01-31"}
+    return [
+        ("GET", "/?days_start=2024-01-01&days_end=2024-01-31"
+                "&exp_start=2024-01-01&exp_end=2024-01-31", None),
+        ("GET", "/bank", None),
+        ("POST", "/bank/statement", month),
+        ("GET", "/lab-collection", None),
+        ("POST", "/report", {**month, "report_type": "all"}),
+        ("GET", "/staffs?month=2024-01", None),
+        ("GET", f"/staffs/{staff_id}/history", None),
+        ("POST", "/staffs/statement/staff", {"staff_id": staff_id, "month": "2024-01"}),
+        ("GET", f"/suppliers/{supplier_id}", None),
+        ("GET", f"/suppliers/{supplier_id}/history", None),
+        ("POST", f"/suppliers/{supplier_id}/report", month),
+        ("POST", "/suppliers/statement", {**month, "supplier_id": supplier_id}),
+        ("POST", "/superadmin/edit-expense", {"form_type": "select_date", "date": "2024-01-01"}),
+    ]
+
+
+def count_statements(client, method: str, url: str, data):
+    statements = []
+
+    def count(*_):
+        statements.append(1)
+
+    with m.app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        resp = client.open(url, method=method, data=data)
+        resp.get_data()  # drain streamed pages inside the counter
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+    assert resp.status_code == 200, (url, resp.status_code)
+    return len(statements)
+
+
+def check_cache_survives_later_write(client) -> bool:
+    """A deposit dated June must not invalidate January's cached statement."""
+    m.report_cache = m.ReportCache(entries=64)
+    january = {"start_date": "2024-01-01", "end_date": "2024-01-31"}
+
+    def cache_state():
+        resp = client.post("/bank/statement", data=january)
+        resp.get_data()
+        return resp.headers.get("X-Report-Cache", "miss")
+
+    cache_state()
+    before = cache_state()
+    client.post("/bank", data={"tx_type": "deposit", "amount": "50", "date": "2024-06-01"})
+    after = cache_state()
+    ok = before == after == "hit"
+    print(f"{'cached January statement after a June deposit':<58}{before:>6}{after:>6}  "
+          f"{'ok' if ok else 'STALE'}")
+    return ok
+
+
+def main() -> int:
+    staff_id, supplier_id = seed_owners()
+    client = m.app.test_client()
+    client.post("/login", data={"username": "dp_mamun", "password": "supersecret"})
+
+    add_rows(0, args.small, staff_id, supplier_id)
+    small = [count_statements(client, *p) for p in pages(staff_id, supplier_id)]
+    add_rows(args.small, args.large, staff_id, supplier_id)
+    large = [count_statements(client, *p) for p in pages(staff_id, supplier_id)]
+
+    failed = 0
+    print(f"{'page':<58}{args.small:>6}{args.large:>6}")
+    for (method, url, _), a, b in zip(pages(staff_id, supplier_id), small, large):
+        status = "ok" if b <= a else "SCALES"
+        failed += status != "ok"
+        print(f"{method + ' ' + url[:52]:<58}{a:>6}{b:>6}  {status}")
+    failed += not check_cache_survives_later_write(client)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,237 @@
+"""
+Route benchmark: drive every main page through the Flask test client.
+
+For each route it reports p50/p95 latency over --runs requests, the SQL
+statements one request issues (streamed bodies included) and the peak
+Python allocation while serving it (measured in a separate pass so
+tracemalloc does not skew the timings). These run with the report cache
+off, so they are the route's real cost; routes that use the cache also
+get warm_p50_ms, the latency of a cache hit. Output is JSON; pass
+--compare with an earlier result to print the change per route.
+
+    python benchmarks/run_routes.py --db sqlite:////tmp/bench.db --seed-years 3 \\
+        --out before.json
+    ...change something...
+    python benchmarks/run_routes.py --db sqlite:////tmp/bench.db --compare before.json
+
+The database is seeded with benchmarks/seed.py when it has no data yet.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--db", help="database URL (default: DATABASE_URL)")
+parser.add_argument("--seed-years", type=int, default=3,
+                    help="years of synthetic data when the database is empty")
+parser.add_argument("--runs", type=int, default=10)
+parser.add_argument("--only", help="run routes whose name contains this text")
+parser.add_argument("--out", help="write the JSON result here (default: stdout)")
+parser.add_argument("--compare", help="earlier JSON result to diff against")
+args = parser.parse_args()
+
+if args.db:
+    os.environ["DATABASE_URL"] = args.db
+if not os.getenv("DATABASE_URL"):
+    raise SystemExit("Set DATABASE_URL or pass --db.")
+
+# Measure the routes themselves, not report cache hits
+os.environ["REPORT_CACHE_ENTRIES"] = "0"
+os.environ.pop("REPORT_CACHE_DIR", None)
+
+import app as m  # noqa: E402
+from seed import seed_database  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+db = m.db
+
+
+def routes(ctx: dict) -> list:
+    """(name, method, path, form data) for every page worth measuring."""
+    today = date.today()
+    month = today.strftime("%Y-%m")
+    month_range = {"start_date": today.replace(day=1).isoformat(), "end_date": today.isoformat()}
+    year_range = {"start_date": (today - timedelta(days=365)).isoformat(),
+                  "end_date": today.isoformat()}
+    staff, supplier = ctx["staff_id"], ctx["supplier_id"]
+    return [
+        ("dashboard", "GET", "/", None),
+        ("dashboard_month_expenses", "GET",
+         f"/?exp_start={month_range['start_date']}&exp_end={month_range['end_date']}", None),
+        ("bank", "GET", "/bank", None),
+        ("bank_page_2", "GET", f"/bank?before={ctx['bank_cursor']}", None),
+        ("bank_statement_year", "POST", "/bank/statement", year_range),
+        ("report_month", "POST", "/report", {**month_range, "report_type": "all"}),
+        ("report_year", "POST", "/report", {**year_range, "report_type": "all"}),
+        ("report_year_pdf", "POST", "/report",
+         {**year_range, "report_type": "all", "format": "pdf"}),
+        ("lab_collection", "GET", "/lab-collection", None),
+        ("staffs", "GET", f"/staffs?month={month}", None),
+        ("staff_history", "GET", f"/staffs/{staff}/history", None),
+        ("staff_statement", "POST", "/staffs/statement/staff",
+         {"staff_id": staff, "month": month}),
+        ("staff_statement_all", "POST", "/staffs/statement/all", {"month": month}),
+        ("suppliers", "GET", "/suppliers", None),
+        ("supplier_detail", "GET", f"/suppliers/{supplier}", None),
+        ("supplier_history", "GET", f"/suppliers/{supplier}/history", None),
+        ("supplier_report_year", "POST", f"/suppliers/{supplier}/report", year_range),
+        ("supplier_statement_year", "POST", "/suppliers/statement",
+         {**year_range, "supplier_id": supplier}),
+        ("delete_history", "GET", "/delete-history", None),
+        ("superadmin", "GET", "/superadmin", None),
+    ]
+
+
+def request_once(client, method, path, data):
+    resp = client.open(path, method=method, data=data)
+    size = len(resp.get_data())  # drains streamed bodies
+    resp.close()
+    if resp.status_code != 200:
+        raise RuntimeError(f"{method} {path} returned {resp.status_code}")
+    return size
+
+
+def warm_p50(client, method, path, data, runs: int):
+    """p50 of cache hits with an in-memory report cache; None if the route never hits it."""
+    m.report_cache = m.ReportCache(entries=64)
+    try:
+        request_once(client, method, path, data)  # fills the cache
+        resp = client.open(path, method=method, data=data)
+        resp.get_data()
+        resp.close()
+        if resp.headers.get("X-Report-Cache") != "hit":
+            return None
+        timings = []
+        for _ in range(runs):
+            began = time.perf_counter()
+            request_once(client, method, path, data)
+            timings.append((time.perf_counter() - began) * 1000)
+        return round(statistics.median(timings), 2)
+    finally:
+        m.report_cache = m.ReportCache(entries=0)
+
+
+def measure(client, method, path, data, runs: int) -> dict:
+    statements = []
+
+    def count(*_):
+        statements.append(1)
+
+    with m.app.app_context():
+        engine = db.engine
+
+    request_once(client, method, path, data)  # warm-up
+
+    event.listen(engine, "before_cursor_execute", count)
+    try:
+        size = request_once(client, method, path, data)
+    finally:
+        event.remove(engine, "before_cursor_execute", count)
+
+    timings = []
+    for _ in range(runs):
+        began = time.perf_counter()
+        request_once(client, method, path, data)
+        timings.append((time.perf_counter() - began) * 1000)
+    timings.sort()
+
+    tracemalloc.start()
+    request_once(client, method, path, data)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "p50_ms": round(statistics.median(timings), 2),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        "warm_p50_ms": warm_p50(client, method, path, data, runs),
+        "queries": len(statements),
+        "peak_kb": round(peak / 1024, 1),
+        "bytes": size,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+def main():
+    with m.app.app_context():
+        if m.DaySummary.query.first() is None:
+            seed_database(m, args.seed_years)
+        ctx = {
+            "staff_id": m.Staff.query.order_by(m.Staff.id).first().id,
+            "supplier_id": m.Supplier.query.order_by(m.Supplier.id).first().id,
+        }
+        rows = {
+            model.__tablename__: model.query.count()
+            for model in (m.DaySummary, m.Expense, m.DoctorBill, m.BalanceEntry,
+                          m.StaffPayment, m.SupplierBill, m.SupplierPayment,
+                          m.LabCollection)
+        }
+        _, ctx["bank_cursor"] = m.keyset_page(
+            m.BalanceEntry.query, m.BalanceEntry.date, m.BalanceEntry.id
+        )
+
+    client = m.app.test_client()
+    client.post("/login", data={"username": "dp_mamun", "password": "supersecret"})
+
+    results = {}
+    for name, method, path, data in routes(ctx):
+        if args.only and args.only not in name:
+            continue
+        results[name] = {"method": method, "path": path,
+                         **measure(client, method, path, data, args.runs)}
+        warm = results[name]["warm_p50_ms"]
+        print(f"{name:<26}{results[name]['p50_ms']:>9.1f} ms cold"
+              f"{warm if warm is not None else '-':>9} ms warm  "
+              f"{results[name]['queries']:>4} queries", file=sys.stderr)
+
+    with m.app.app_context():
+        dialect = db.engine.dialect.name
+    output = {
+        "meta": {
+            "revision": git_revision(),
+            "dialect": dialect,
+            "runs": args.runs,
+            "rows": rows,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "routes": results,
+    }
+
+    text = json.dumps(output, indent=2)
+    if args.out:
+        with open(args.out, "w") as fh:
+            fh.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare) as fh:
+            before = json.load(fh)["routes"]
+        print(f"\n{'route':<26}{'cold p50 ms':>16}{'queries':>12}{'peak KB':>18}", file=sys.stderr)
+        for name, now in results.items():
+            old = before.get(name)
+            if not old:
+                continue
+            print(f"{name:<26}{old['p50_ms']:>7.1f} → {now['p50_ms']:<7.1f}"
+                  f"{old['queries']:>5} → {now['queries']:<5}"
+                  f"{old['peak_kb']:>8.0f} → {now['peak_kb']:<8.0f}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()